@@ -1,32 +1,53 @@
 # Date:   03/08/2015
 # Author: Long Chen
 # Description: A class to get aws access key and secret of an AWS account
+# The credentials file is parsed once, and parsed again only when the file is modified
 
 import os
+import threading
 import ConfigParser
 
 class awsAccount:
-    _aws_access_key_id = None 
+    _aws_access_key_id = None
     _aws_secret_access_key = None
 
+    # Parsed credentials by account name, and modification time of the credentials file
+    _accounts = None
+    _mtime = None
+    _lock = threading.Lock()
+
     def __init__(self, account):
-        base_path = os.path.dirname(os.path.realpath(__file__))
-        CRED = base_path + '/conf/awscred'
-        Config = ConfigParser.ConfigParser()
-        # Read configuration file
-        Config.read(CRED)
-        dict = {}
+        accounts = awsAccount._readAccounts()
+        if account not in accounts:
+            raise ConfigParser.NoSectionError(account)
         # Read account profile section in the file
-        options = Config.options(account)
-        # Read configuration optons in the account section
-        for option in options:
-           try:
-                dict[option] = Config.get(account, option)
-                if dict[option] == -1:
-                    DebugPrint("skip: %s" % option)
-           except:
-                print("exception on %s!" % option)
-                dict[option] = None
+        dict = accounts[account]
         # Store the access key data to the class
         self._aws_access_key_id = dict['aws_access_key_id']
         self._aws_secret_access_key = dict['aws_secret_access_key']
+
+    # Read all account sections of the credentials file, if it has been modified since it was read
+    @classmethod
+    def _readAccounts(cls):
+        base_path = os.path.dirname(os.path.realpath(__file__))
+        CRED = base_path + '/conf/awscred'
+        mtime = os.stat(CRED).st_mtime
+        with cls._lock:
+            if mtime != cls._mtime:
+                Config = ConfigParser.ConfigParser()
+                # Read configuration file
+                Config.read(CRED)
+                accounts = {}
+                for account in Config.sections():
+                    dict = {}
+                    # Read configuration optons in the account section
+                    for option in Config.options(account):
+                       try:
+                            dict[option] = Config.get(account, option)
+                       except:
+                            print("exception on %s!" % option)
+                            dict[option] = None
+                    accounts[account] = dict
+                cls._accounts = accounts
+                cls._mtime = mtime
+            return cls._accounts
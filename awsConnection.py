@@ -1,7 +1,11 @@
 # Date:   03/08/2015
 # Author: Long Chen
 # Description: A class to establish connections to aws services
+# Connections are cached and reused by (service, region, account), boto keeps the
+# http connections of a cached connection alive in its own connection pool
 
+import time
+import threading
 import boto.ec2.cloudwatch
 import boto.ec2.elb
 import boto.sqs
@@ -13,43 +17,110 @@ import boto.route53
 import boto.emr
 
 class awsConnection:
+    # Evict cached connections which are not used for more than the idle timeout in seconds
+    IDLE_TIMEOUT = 600
+
     _aws_connection = None
 
+    # Cached connections by (service, region, access key, thread id)
+    # boto connections are not thread safe, so every thread has its own connection
+    _connections = {}
+    _connections_lock = threading.Lock()
+
     def __init__(self):
         _aws_connection = None
 
+    # Get a cached connection or create a new one
+    def _connect(self, service, connect_to_region, region, access_key, secret_key):
+        key = (service, region, access_key, threading.current_thread().ident)
+        now = time.time()
+        with awsConnection._connections_lock:
+            awsConnection._evictIdle(now)
+            entry = awsConnection._connections.get(key)
+            if entry is None:
+                connection = connect_to_region(region, aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+                entry = {'connection': connection, 'created': now, 'last_used': now, 'reuse_count': 0}
+                # Don't cache a failed connection, e.g. unknown region
+                if connection is not None:
+                    awsConnection._connections[key] = entry
+            else:
+                entry['last_used'] = now
+                entry['reuse_count'] = entry['reuse_count'] + 1
+        self._aws_connection = entry['connection']
+
+    # Close and remove connections which are idle for more than the idle timeout
+    # Must be called with the connections lock held
+    @classmethod
+    def _evictIdle(cls, now):
+        for key, entry in cls._connections.items():
+            if now - entry['last_used'] > cls.IDLE_TIMEOUT:
+                cls._close(entry['connection'])
+                del cls._connections[key]
+
+    # Close the http connections of a boto connection, dynamodb layer2 wraps a layer1 connection
+    @staticmethod
+    def _close(connection):
+        if hasattr(connection, 'layer1'):
+            connection = connection.layer1
+        connection.close()
+
+    # Get the statistics of cached connections, a list of dicts of service, region, access key, thread, created, last used and reuse count
+    @classmethod
+    def connectionStats(cls):
+        stats = []
+        with cls._connections_lock:
+            for (service, region, access_key, thread_id), entry in cls._connections.items():
+                stats.append({
+                    'service': service,
+                    'region': region,
+                    'access_key': access_key,
+                    'thread': thread_id,
+                    'created': entry['created'],
+                    'last_used': entry['last_used'],
+                    'reuse_count': entry['reuse_count'],
+                })
+        return stats
+
+    # Close and remove all cached connections
+    @classmethod
+    def closeAll(cls):
+        with cls._connections_lock:
+            for entry in cls._connections.values():
+                cls._close(entry['connection'])
+            cls._connections.clear()
+
     # CloudWatch connection
     def cloudwatchConnect(self, region, access_key, secret_key):
-        self._aws_connection = boto.ec2.cloudwatch.connect_to_region(region, aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+        self._connect('cloudwatch', boto.ec2.cloudwatch.connect_to_region, region, access_key, secret_key)
 
     # ELB connection
     def elbConnect(self, region, access_key, secret_key):
-        self._aws_connection = boto.ec2.elb.connect_to_region(region, aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+        self._connect('elb', boto.ec2.elb.connect_to_region, region, access_key, secret_key)
 
     # SQS connection
     def sqsConnect(self, region, access_key, secret_key):
-        self._aws_connection = boto.sqs.connect_to_region(region, aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+        self._connect('sqs', boto.sqs.connect_to_region, region, access_key, secret_key)
 
     # RDS connection
     def rdsConnect(self, region, access_key, secret_key):
-        self._aws_connection = boto.rds.connect_to_region(region, aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+        self._connect('rds', boto.rds.connect_to_region, region, access_key, secret_key)
 
     # DynamoDB connection
     def dynamodbConnect(self, region, access_key, secret_key):
-        self._aws_connection = boto.dynamodb.connect_to_region(region, aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+        self._connect('dynamodb', boto.dynamodb.connect_to_region, region, access_key, secret_key)
 
     # Redshift connection
     def redshiftConnect(self, region, access_key, secret_key):
-        self._aws_connection = boto.redshift.connect_to_region(region, aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+        self._connect('redshift', boto.redshift.connect_to_region, region, access_key, secret_key)
 
     # SNS connection
     def snsConnect(self, region, access_key, secret_key):
-        self._aws_connection = boto.sns.connect_to_region(region, aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+        self._connect('sns', boto.sns.connect_to_region, region, access_key, secret_key)
 
     # Route53 connection
     def route53Connect(self, region, access_key, secret_key):
-        self._aws_connection = boto.route53.connect_to_region(region, aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+        self._connect('route53', boto.route53.connect_to_region, region, access_key, secret_key)
 
     # EMR connection
     def emrConnect(self, region, access_key, secret_key):
-        self._aws_connection = boto.emr.connect_to_region(region, aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+        self._connect('emr', boto.emr.connect_to_region, region, access_key, secret_key)
@@ -0,0 +1,121 @@
+# Description: A class to look up the JobFlowId of running EMR clusters by cluster name
+# Clusters of an account and region are listed once, with all pages, and kept in a file for a time to live,
+# so every EMR resource and every process shares one listing
+# A cluster whose JobFlowId got no data is looked up in a new listing, it may have been replaced by a cluster with the same name
+
+import os
+import sys
+import json
+import time
+import fcntl
+import errno
+import threading
+from awsAccount import awsAccount
+from awsConnection import awsConnection
+
+class awsEMRClusterIndex:
+    # Same directory as the resource listings cached by awsLLD.py
+    CACHE_DIR = '/var/tmp/zabbix-cloudwatch'
+    # Time to live of a listing in seconds, 0 to list clusters on every lookup
+    TTL = 900
+    # Min age in seconds of a listing refreshed when a cluster name is not in it, e.g. a cluster that just started
+    MISS_TTL = 300
+    # Clusters that can be monitored
+    CLUSTER_STATES = ['RUNNING', 'WAITING']
+
+    _cache_dir = CACHE_DIR
+    _ttl = TTL
+    _miss_ttl = MISS_TTL
+    _indexes = None
+    _no_data = None
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl=TTL, miss_ttl=MISS_TTL):
+        self._cache_dir = cache_dir
+        self._ttl = ttl
+        self._miss_ttl = min(miss_ttl, ttl)
+        # Time of the listing and JobFlowId by cluster name, by account and region
+        self._indexes = {}
+        # Clusters whose JobFlowId got no data, by account, region and cluster name
+        self._no_data = set()
+        self._lock = threading.Lock()
+
+    # List running clusters of an account and region, returns a dict of JobFlowId by cluster name
+    # A name used by several clusters keeps the last one listed
+    def _listClusters(self, account, aws_region):
+        aws = awsAccount(account)
+        conn = awsConnection()
+        conn.emrConnect(aws_region, aws._aws_access_key_id, aws._aws_secret_access_key)
+        emr = conn._aws_connection
+
+        clusters = {}
+        marker = None
+        while True:
+            page = emr.list_clusters(cluster_states=self.CLUSTER_STATES, marker=marker)
+            for cluster in page.clusters or []:
+                clusters[cluster.name] = cluster.id
+            marker = getattr(page, 'marker', None)
+            if not marker:
+                break
+        return clusters
+
+    def _indexFile(self, account, aws_region):
+        return os.path.join(self._cache_dir, 'emr.' + account + '.' + aws_region + '.json')
+
+    # Get the index of an account and region, listing the clusters again if it is older than max age
+    # Only one process refreshes an expired index, the other processes wait for it and read the file
+    def _getIndex(self, account, aws_region, max_age):
+        index = self._indexes.get((account, aws_region))
+        if index is not None and time.time() - index[0] < max_age:
+            return index[1]
+
+        index_file = self._indexFile(account, aws_region)
+        try:
+            os.makedirs(self._cache_dir)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        lock = open(index_file + '.lock', 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.exists(index_file) or time.time() - os.path.getmtime(index_file) >= max_age:
+                try:
+                    clusters = self._listClusters(account, aws_region)
+                except Exception, e:
+                    # Keep using an expired index rather than losing all EMR data while the listing fails
+                    if not os.path.exists(index_file):
+                        raise
+                    print >> sys.stderr, 'Error listing EMR clusters in %s %s, using the previous listing: %s' % (account, aws_region, e)
+                    os.utime(index_file, None)
+                else:
+                    # Write to a temp file and rename it, so readers never see a partial index
+                    tmp_file = index_file + '.tmp'
+                    with open(tmp_file, 'w') as f:
+                        json.dump(clusters, f)
+                    os.rename(tmp_file, index_file)
+            listed = os.path.getmtime(index_file)
+            with open(index_file) as f:
+                clusters = json.load(f)
+        finally:
+            lock.close()
+
+        self._indexes[(account, aws_region)] = (listed, clusters)
+        return clusters
+
+    # Get the JobFlowId of a running cluster by name, None if there is no such cluster
+    def get(self, account, aws_region, cluster_name):
+        if self._ttl <= 0:
+            return self._listClusters(account, aws_region).get(cluster_name)
+        with self._lock:
+            if (account, aws_region, cluster_name) in self._no_data:
+                self._no_data.discard((account, aws_region, cluster_name))
+                return self._getIndex(account, aws_region, self._miss_ttl).get(cluster_name)
+            job_flow_id = self._getIndex(account, aws_region, self._ttl).get(cluster_name)
+            if job_flow_id is None:
+                job_flow_id = self._getIndex(account, aws_region, self._miss_ttl).get(cluster_name)
+        return job_flow_id
+
+    # Mark a cluster whose JobFlowId got no data, e.g. it was terminated and a new cluster started with the same name
+    # Its next lookup lists the clusters again if the listing is older than the miss time to live
+    def noData(self, account, aws_region, cluster_name):
+        with self._lock:
+            self._no_data.add((account, aws_region, cluster_name))
@@ -0,0 +1,68 @@
+# Description: A bounded pool of worker threads to run aws api calls concurrently
+
+import sys
+import threading
+import Queue
+
+class awsFetchPool:
+    _workers = 1
+    _tasks = None
+    _threads = None
+
+    def __init__(self, workers=1):
+        # Max number of concurrent calls
+        self._workers = max(1, int(workers))
+        self._tasks = Queue.Queue()
+        self._threads = []
+
+    # Start worker threads on first use, they are reused for every map call
+    def _start(self):
+        while len(self._threads) < self._workers:
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            task = self._tasks.get()
+            # Stop the worker when the pool is closed
+            if task is None:
+                break
+            func, item, n, results, errors, done = task
+            # The call is always marked done, so map never waits forever for a call that raised
+            try:
+                results[n] = func(item)
+            except:
+                errors.append(sys.exc_info())
+            finally:
+                done.release()
+
+    # Call a function for every item, returns the results in the same order as the items
+    # The first exception raised by a call is raised again once all calls are finished
+    def map(self, func, items):
+        items = list(items)
+        # No threads needed for sequential calls
+        if self._workers == 1 or len(items) <= 1:
+            return [func(item) for item in items]
+
+        self._start()
+        results = [None] * len(items)
+        errors = []
+        done = threading.Semaphore(0)
+        for n, item in enumerate(items):
+            self._tasks.put((func, item, n, results, errors, done))
+        for item in items:
+            done.acquire()
+        if errors:
+            exc_type, exc_value, exc_traceback = errors[0]
+            raise exc_type, exc_value, exc_traceback
+        return results
+
+    # Stop all worker threads
+    def close(self):
+        for thread in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
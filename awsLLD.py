@@ -4,193 +4,263 @@
 # Author: Long Chen
 # Description: A script to discover aws dimensions in a component  e.g. SQS queues, DynamoDB tables
 # Example Usage: omniAWSLLD.py -a awscore -r us-east-1 -q DynamoDBTables -c catalogue-management-PROD
+# Bulk Usage: awsLLD.py -a awscore -r us-east-1 -q DynamoDBTables -c catalogue-management-PROD -c order-management-PROD
 
+import os
 import re
 import json
+import time
+import fcntl
+import errno
 from optparse import OptionParser
 from awsAccount import awsAccount
 from awsConnection import awsConnection
+from boto.sqs.queue import Queue
+
+# Resource listings are cached in files, so all discovery rules of an account and region share one listing
+lld_cache_dir = '/var/tmp/zabbix-cloudwatch'
+# Time to live of a cached listing in seconds, 0 to disable the cache
+lld_cache_ttl = 300
+
+# Precompiled filters
+dead_re = re.compile('dead', re.I)
+prod_re = re.compile('prod', re.I)
+test_re = re.compile('test', re.I)
 
 def config_parser():
     parser = OptionParser(usage="usage: %prog [options]", version="%prog 1.0")
     parser.add_option("-a", "--account", dest="accountname", help="account name", metavar="ACCOUNT")
     parser.add_option("-r", "--region", dest="region", help="region", metavar="REGION")
     parser.add_option("-q", "--query", dest="query", help="specify a query", metavar="QUERY")
-    parser.add_option("-c", "--component", dest="component", help="component name", metavar="COMPONENT")
+    parser.add_option("-c", "--component", dest="component", action="append", help="component name, repeat to discover many components", metavar="COMPONENT")
+    parser.add_option("-t", "--ttl", dest="ttl", help="time to live of cached resource listings in seconds", metavar="TTL")
     return parser
 
-def getSQSMainQueueByComponent(a, r, c):
-    account = a
-    aws_account = awsAccount(account)
-    aws_access_key_id = aws_account._aws_access_key_id
-    aws_secret_access_key = aws_account._aws_secret_access_key
-    aws_region = r
-    component = c
-    # Init LLD Data
-    lldlist = []
-    llddata = {"data":lldlist}
-    # Connect to SQS
-    conn = awsConnection()
-    conn.sqsConnect(aws_region, aws_access_key_id, aws_secret_access_key)
-    sqsConn = conn._aws_connection
-    # Get a list all SQS queues
-    queues = sqsConn.get_all_queues()
-
-    # Save queue names in a list
-    qdata = []
-    for q in queues:
-        qname = q.name
-        # Filter out dead letter queues and only get the queues for a component in PROD
-        if not re.search('dead', qname, re.I) and re.search(component, qname) and re.search('prod', qname, re.I):
-            qdata.append(qname)
-
-    # Add Zabbix LLD Macros into LLD data
-    if qdata:
-        for x in qdata:
-            dict = {}
-            # Get queue name
-            dict["{#MQNAME}"] = x
-            # Get short queue name by removing component name
-            dict["{#MINAME}"] = re.sub(component + '(-?)', '', x)
-            lldlist.append(dict)
-
-    # Print LLD data in json format
-    print json.dumps(llddata, indent=4)
+# Iterate over the items of all pages of a paginated listing, one page is kept in memory at a time
+# fetch_page(token) returns the items of a page and the token of the next page, None on the last page
+def paginate(fetch_page):
+    token = None
+    while True:
+        items, token = fetch_page(token)
+        for item in items:
+            yield item
+        if not token:
+            break
 
-def getSQSDeadLetterQueueByComponent(a, r, c):
+# Iterate over all SQS queue names
+def listSQSQueues(a, r):
     account = a
     aws_account = awsAccount(account)
     aws_access_key_id = aws_account._aws_access_key_id
     aws_secret_access_key = aws_account._aws_secret_access_key
     aws_region = r
-    component = c
-    # Init LLD Data
-    lldlist = []
-    llddata = {"data":lldlist}
     # Connect to SQS
     conn = awsConnection()
     conn.sqsConnect(aws_region, aws_access_key_id, aws_secret_access_key)
     sqsConn = conn._aws_connection
 
-    # Get a list of all SQS queues
-    queues = sqsConn.get_all_queues()
-
-    # Save queue names in a list
-    qdata = []
-    for q in queues:
-        qname = q.name
-        # Search for DEAD letter queue in PROD
-        if re.search('dead', qname, re.I) and re.search(component, qname) and re.search('prod', qname, re.I):
-            qdata.append(qname)
-    
-    # Add Zabbix LLD Macros into LLD data
-    if qdata:
-        for x in qdata:
-            dict = {}
-            # Get queue name
-            dict["{#DQNAME}"] = x
-            # Get short queue name by removing component name
-            dict["{#DINAME}"] = re.sub(component + '(-?)', '', x)
-            lldlist.append(dict)
+    # Get a page of SQS queues, ListQueues returns at most 1000 queues per page
+    def fetchPage(token):
+        params = {'MaxResults': 1000}
+        if token:
+            params['NextToken'] = token
+        queues = sqsConn.get_list('ListQueues', params, [('QueueUrl', Queue)])
+        return [q.name for q in queues], queues.next_token
 
-    # Print LLD data in json format
-    print json.dumps(llddata, indent=4)
+    return paginate(fetchPage)
 
-def getDynamoDBTables(a, r, c):
+# Iterate over all DynamoDB table names
+def listDynamoDBTables(a, r):
     account = a
     aws_account = awsAccount(account)
     aws_access_key_id = aws_account._aws_access_key_id
     aws_secret_access_key = aws_account._aws_secret_access_key
     aws_region = r
-    component = c
-    # Init LLD Data
-    lldlist = []
-    llddata = {"data":lldlist}
     # Connect to DynamoDB service
     conn = awsConnection()
     conn.dynamodbConnect(aws_region, aws_access_key_id, aws_secret_access_key)
     dynamoDBConn = conn._aws_connection
-    # Get a list of DynamoDB tables
-    tables = dynamoDBConn.layer1.list_tables()
-
-    # Save table names in a list
-    tdata = []
-    for tname in tables['TableNames']:
-        # Filter out table names and only get the DynamoDB tables for a component in PROD
-        if re.search(component, tname) and not re.search('test', tname, re.I):
-            tdata.append(tname)
-
-    # Add Zabbix LLD Macros into LLD data
-    if tdata:
-        for x in tdata:
-            dict = {}
-            # Get aws account
-            dict["{#AWS_ACCOUNT}"] = a
-            # Get aws region
-            dict["{#AWS_REGION}"] = r
-            # Get table name
-            dict["{#TABLE_NAME}"] = x
-            lldlist.append(dict)
 
-    # Print LLD data in json format
-    print json.dumps(llddata, indent=4)
+    # Get a page of DynamoDB tables, ListTables returns at most 100 tables per page
+    def fetchPage(token):
+        tables = dynamoDBConn.layer1.list_tables(start_table=token)
+        return tables['TableNames'], tables.get('LastEvaluatedTableName')
 
-def getSNSTopics(a, r, c):
+    return paginate(fetchPage)
+
+# Iterate over all SNS topic names
+def listSNSTopics(a, r):
     account = a
     aws_account = awsAccount(account)
     aws_access_key_id = aws_account._aws_access_key_id
     aws_secret_access_key = aws_account._aws_secret_access_key
     aws_region = r
-    component = c
-    # Init LLD Data
-    lldlist = []
-    llddata = {"data":lldlist}
-    # Connect to DynamoDB service
+    # Connect to SNS service
     conn = awsConnection()
     conn.snsConnect(aws_region, aws_access_key_id, aws_secret_access_key)
     snsConn = conn._aws_connection
+    # Remove prefix string "arn:aws:sns:<aws region>:<random number>:" from topic arn
+    arn_prefix_re = re.compile('^arn:aws:sns:' + aws_region + ':[0-9]+:')
+
+    # Get a page of SNS Topics, the next token is used to get the next page
+    def fetchPage(token):
+        topicsResults = snsConn.get_all_topics(token)
+        topicsResult = topicsResults['ListTopicsResponse']['ListTopicsResult']
+        return [arn_prefix_re.sub('', t['TopicArn']) for t in topicsResult['Topics']], topicsResult['NextToken']
+
+    return paginate(fetchPage)
+
+# Resource listing functions by resource type
+resource_listings = {
+    'SQSQueues': listSQSQueues,
+    'DynamoDBTables': listDynamoDBTables,
+    'SNSTopics': listSNSTopics,
+}
+
+# Iterate over resource names of a resource type in an account and region, from the cache if it is not expired
+# Names are cached in a file, one name per line, and streamed from the listing or the file
+def getResourceNames(a, r, t):
+    account = a
+    aws_region = r
+    resource_type = t
 
-    # Save SNS topics results in a list
-    topicsResultsList = []
-    # Save topic names in a list
-    tdata = []
-
-    # Get a list of SNS Topics
-    topicsResults = snsConn.get_all_topics()
-    topicsResultsList.append(topicsResults)
-    # Get next token from current results, which will be used to get the next one
-    nextToken = topicsResults['ListTopicsResponse']['ListTopicsResult']['NextToken']
-    # If next token is not empty, get the next topic list
-    while nextToken:
-        topicsResults = snsConn.get_all_topics(nextToken)
-        topicsResultsList.append(topicsResults)
-        nextToken = topicsResults['ListTopicsResponse']['ListTopicsResult']['NextToken']
-
-    for tr in topicsResultsList:
-        for t in tr['ListTopicsResponse']['ListTopicsResult']['Topics']:
-            topicArn = t['TopicArn']
-            # Remove prefix string "arn:aws:sns:<aws region>:<random number>:" from topic arn
-            topicName = re.sub('^arn:aws:sns:' + r + ':[0-9]+:', '', topicArn)
-            # Filter out topic names and only get the topic names for a component in PROD
-            if re.search(component, topicName) and re.search('prod', topicName, re.I):
-                tdata.append(topicName)
-
-    # Add Zabbix LLD Macros into LLD data
-    if tdata:
-        for x in tdata:
-            dict = {}
-            # Get aws account
-            dict["{#AWS_ACCOUNT}"] = a
-            # Get aws region
-            dict["{#AWS_REGION}"] = r
-            # Get topic name
-            dict["{#TOPIC_NAME}"] = x
-            # Get short topic name by removing component name
-            dict["{#TOPIC_INAME}"] = re.sub(component + '(-?)', '', x)
-            lldlist.append(dict)
+    listing = resource_listings[resource_type]
+    if lld_cache_ttl <= 0:
+        for name in listing(account, aws_region):
+            yield name
+        return
 
+    cache_file = lld_cache_dir + '/lld.' + account + '.' + aws_region + '.' + resource_type
+    # Another process may create the cache directory at the same time
+    try:
+        os.makedirs(lld_cache_dir)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    # Only one process refreshes an expired listing, the other processes wait for it and read the cache
+    lock = open(cache_file + '.lock', 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if not os.path.exists(cache_file) or time.time() - os.path.getmtime(cache_file) > lld_cache_ttl:
+            # Write to a temp file and rename it, so readers never see a partial listing
+            tmp_file = cache_file + '.tmp'
+            cache = open(tmp_file, 'w')
+            for name in listing(account, aws_region):
+                cache.write(name.encode('utf-8') + '\n')
+            cache.close()
+            os.rename(tmp_file, cache_file)
+    finally:
+        lock.close()
+
+    for line in open(cache_file):
+        yield line.rstrip('\n').decode('utf-8')
+
+# Get LLD macros of a SQS main queue, or None if the queue is not a main queue of the component
+def sqsMainQueueMacros(a, r, component_re, strip_re, qname):
+    # Filter out dead letter queues and only get the queues for a component in PROD
+    if not dead_re.search(qname) and component_re.search(qname) and prod_re.search(qname):
+        dict = {}
+        # Get queue name
+        dict["{#MQNAME}"] = qname
+        # Get short queue name by removing component name
+        dict["{#MINAME}"] = strip_re.sub('', qname)
+        return dict
+    return None
+
+# Get LLD macros of a SQS dead letter queue, or None if the queue is not a dead letter queue of the component
+def sqsDeadLetterQueueMacros(a, r, component_re, strip_re, qname):
+    # Search for DEAD letter queue in PROD
+    if dead_re.search(qname) and component_re.search(qname) and prod_re.search(qname):
+        dict = {}
+        # Get queue name
+        dict["{#DQNAME}"] = qname
+        # Get short queue name by removing component name
+        dict["{#DINAME}"] = strip_re.sub('', qname)
+        return dict
+    return None
+
+# Get LLD macros of a DynamoDB table, or None if the table doesn't belong to the component
+def dynamoDBTableMacros(a, r, component_re, strip_re, tname):
+    # Filter out table names and only get the DynamoDB tables for a component in PROD
+    if component_re.search(tname) and not test_re.search(tname):
+        dict = {}
+        # Get aws account
+        dict["{#AWS_ACCOUNT}"] = a
+        # Get aws region
+        dict["{#AWS_REGION}"] = r
+        # Get table name
+        dict["{#TABLE_NAME}"] = tname
+        return dict
+    return None
+
+# Get LLD macros of a SNS topic, or None if the topic doesn't belong to the component
+def snsTopicMacros(a, r, component_re, strip_re, topicName):
+    # Filter out topic names and only get the topic names for a component in PROD
+    if component_re.search(topicName) and prod_re.search(topicName):
+        dict = {}
+        # Get aws account
+        dict["{#AWS_ACCOUNT}"] = a
+        # Get aws region
+        dict["{#AWS_REGION}"] = r
+        # Get topic name
+        dict["{#TOPIC_NAME}"] = topicName
+        # Get short topic name by removing component name
+        dict["{#TOPIC_INAME}"] = strip_re.sub('', topicName)
+        return dict
+    return None
+
+# Resource type and LLD macros function of each query
+lld_queries = {
+    'SQSMainQueue': ('SQSQueues', sqsMainQueueMacros),
+    'SQSDeadLetterQueue': ('SQSQueues', sqsDeadLetterQueueMacros),
+    'DynamoDBTables': ('DynamoDBTables', dynamoDBTableMacros),
+    'SNSTopics': ('SNSTopics', snsTopicMacros),
+}
+
+# Get LLD data of many components from one resource listing, returns LLD data by component
+def getLLDData(a, r, q, c):
+    account = a
+    aws_region = r
+    query = q
+    components = c
+
+    resource_type, macros = lld_queries[query]
+    # Init LLD Data and precompile component filters
+    llddata = {}
+    filters = []
+    for component in components:
+        llddata[component] = {"data": []}
+        # Component name is removed from resource names to get short names
+        filters.append((component, re.compile(component), re.compile(component + '(-?)')))
+    # Names not matching any component are skipped with a single search
+    any_component_re = re.compile('|'.join('(?:' + component + ')' for component in components))
+
+    for name in getResourceNames(account, aws_region, resource_type):
+        if not any_component_re.search(name):
+            continue
+        for component, component_re, strip_re in filters:
+            dict = macros(account, aws_region, component_re, strip_re, name)
+            # Add Zabbix LLD Macros into LLD data
+            if dict is not None:
+                llddata[component]["data"].append(dict)
+    return llddata
+
+def getSQSMainQueueByComponent(a, r, c):
     # Print LLD data in json format
-    print json.dumps(llddata, indent=4)
+    print json.dumps(getLLDData(a, r, 'SQSMainQueue', [c])[c], indent=4)
+
+def getSQSDeadLetterQueueByComponent(a, r, c):
+    # Print LLD data in json format
+    print json.dumps(getLLDData(a, r, 'SQSDeadLetterQueue', [c])[c], indent=4)
+
+def getDynamoDBTables(a, r, c):
+    # Print LLD data in json format
+    print json.dumps(getLLDData(a, r, 'DynamoDBTables', [c])[c], indent=4)
+
+def getSNSTopics(a, r, c):
+    # Print LLD data in json format
+    print json.dumps(getLLDData(a, r, 'SNSTopics', [c])[c], indent=4)
 
 if __name__ == '__main__':
     parser = config_parser()
@@ -199,16 +269,15 @@ if __name__ == '__main__':
     account = options.accountname
     region = options.region
     query = options.query
-    component = options.component
-
-    if query == 'SQSMainQueue':
-        getSQSMainQueueByComponent(account, region, component)
-    elif query == 'SQSDeadLetterQueue':
-        getSQSDeadLetterQueueByComponent(account, region, component)
-    elif query == 'DynamoDBTables':
-        getDynamoDBTables(account, region, component)
-    elif query == 'SNSTopics':
-        getSNSTopics(account, region, component)
-    else:
-        print 'Unknown Query'
+    components = options.component or []
+    if options.ttl is not None:
+        lld_cache_ttl = int(options.ttl)
 
+    if query not in lld_queries:
+        print 'Unknown Query'
+    elif len(components) == 1:
+        # Print LLD data of a component in json format
+        print json.dumps(getLLDData(account, region, query, components)[components[0]], indent=4)
+    else:
+        # Print LLD data of all components in json format, by component name
+        print json.dumps(getLLDData(account, region, query, components), indent=4)
@@ -0,0 +1,106 @@
+# Description: A class to get cloudwatch data of many metrics in batches by using the GetMetricData API
+# boto only implements GetMetricStatistics, so the request is built on top of the boto cloudwatch connection
+
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime
+
+class awsMetricData:
+    # Max number of metric queries in one GetMetricData request
+    MAX_QUERIES = 500
+    # Timestamp format used in cloudwatch responses
+    TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+    _aws_connection = None
+
+    def __init__(self, connection):
+        # A boto cloudwatch connection
+        self._aws_connection = connection
+
+    # Build GetMetricData request parameters of a batch of metric queries
+    def _buildParams(self, period, start_time, end_time, queries):
+        params = {
+            'StartTime': start_time.isoformat(),
+            'EndTime': end_time.isoformat(),
+            'ScanBy': 'TimestampDescending',
+        }
+        for n, query in enumerate(queries, 1):
+            prefix = 'MetricDataQueries.member.%d.' % n
+            # Query ids must start with a lower case letter
+            params[prefix + 'Id'] = 'q%d' % n
+            params[prefix + 'ReturnData'] = 'true'
+            params[prefix + 'MetricStat.Period'] = str(period)
+            params[prefix + 'MetricStat.Stat'] = query['statistics']
+            params[prefix + 'MetricStat.Metric.Namespace'] = query['namespace']
+            params[prefix + 'MetricStat.Metric.MetricName'] = query['metric']
+            for m, (name, value) in enumerate(sorted(query['dimensions'].items()), 1):
+                params[prefix + 'MetricStat.Metric.Dimensions.member.%d.Name' % m] = name
+                params[prefix + 'MetricStat.Metric.Dimensions.member.%d.Value' % m] = value
+        return params
+
+    # Find all child elements by tag name, ignoring the xml namespace
+    def _findAll(self, element, tag):
+        return [child for child in element.iter() if child.tag.split('}')[-1] == tag]
+
+    # Find the text of the first direct child element by tag name, ignoring the xml namespace
+    def _findText(self, element, tag):
+        for child in element:
+            if child.tag.split('}')[-1] == tag:
+                return child.text
+        return None
+
+    # Parse a GetMetricData response, returns results by query id and the next token
+    def _parseResponse(self, body):
+        root = ElementTree.fromstring(body)
+        results = {}
+        for member in self._findAll(root, 'MetricDataResults'):
+            for result in member:
+                query_id = self._findText(result, 'Id')
+                timestamps = []
+                values = []
+                for child in result:
+                    name = child.tag.split('}')[-1]
+                    if name == 'Timestamps':
+                        timestamps = [datetime.strptime(t.text, self.TIMESTAMP_FORMAT) for t in child]
+                    elif name == 'Values':
+                        values = [float(v.text) for v in child]
+                results[query_id] = zip(timestamps, values)
+        next_token = None
+        for token in self._findAll(root, 'NextToken'):
+            next_token = token.text
+        return results, next_token
+
+    # Get cloudwatch data of a batch of no more than MAX_QUERIES metric queries
+    def _getBatch(self, period, start_time, end_time, queries):
+        cw = self._aws_connection
+        params = self._buildParams(period, start_time, end_time, queries)
+        datapoints = {}
+        next_token = None
+        while True:
+            if next_token:
+                params['NextToken'] = next_token
+            response = cw.make_request('GetMetricData', params, '/', 'POST')
+            body = response.read()
+            if response.status != 200:
+                raise cw.ResponseError(response.status, response.reason, body)
+            results, next_token = self._parseResponse(body)
+            # Partial results are continued in the next page
+            for query_id, points in results.items():
+                datapoints.setdefault(query_id, []).extend(points)
+            if not next_token:
+                break
+        return datapoints
+
+    # Get cloudwatch data of metric queries, a query is a dict of namespace, metric, statistics and dimensions
+    # Returns a list of datapoints for each query, in the same format as get_metric_statistics
+    def getMetricData(self, period, start_time, end_time, queries):
+        cloud_watch_results = []
+        for i in range(0, len(queries), self.MAX_QUERIES):
+            batch = queries[i:i + self.MAX_QUERIES]
+            datapoints = self._getBatch(period, start_time, end_time, batch)
+            for n, query in enumerate(batch, 1):
+                statistics = query['statistics']
+                results = []
+                for timestamp, value in datapoints.get('q%d' % n, []):
+                    results.append({'Timestamp': timestamp, statistics: value})
+                cloud_watch_results.append(results)
+        return cloud_watch_results
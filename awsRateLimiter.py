@@ -0,0 +1,59 @@
+# Description: A token bucket rate limiter for aws api calls, shared by all threads using the same account and region
+
+import time
+import threading
+from boto.exception import BotoServerError
+
+class awsRateLimiter:
+    # Error codes returned by aws when a request is throttled
+    THROTTLE_ERRORS = ('Throttling', 'ThrottlingException', 'RequestLimitExceeded')
+    # Number of retries of a throttled request, with exponential backoff
+    THROTTLE_RETRIES = 4
+
+    # Rate limiters by key, e.g. (account, region, api)
+    _limiters = {}
+    _limiters_lock = threading.Lock()
+
+    def __init__(self, rate, burst=None):
+        # Requests per second
+        self._rate = float(rate)
+        # Max number of requests in a burst
+        self._capacity = float(burst or rate)
+        self._tokens = self._capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    # Get the shared rate limiter of a key, create it if it doesn't exist
+    @classmethod
+    def getLimiter(cls, key, rate, burst=None):
+        with cls._limiters_lock:
+            if key not in cls._limiters:
+                cls._limiters[key] = cls(rate, burst)
+            return cls._limiters[key]
+
+    # Wait until a request is allowed
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                # Refill tokens for the time passed since the last request
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+
+    # Call an aws api function within the rate limit, retry it with backoff if aws throttles the request
+    def call(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                return func(*args, **kwargs)
+            except BotoServerError, error:
+                if error.error_code not in self.THROTTLE_ERRORS or attempt >= self.THROTTLE_RETRIES:
+                    raise
+                time.sleep(2 ** attempt)
+                attempt = attempt + 1
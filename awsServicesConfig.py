@@ -0,0 +1,147 @@
+# Description: A class to read aws services metrics configuration and compile metric plans of each service
+# The configuration file is parsed once, and parsed again only when the file is modified
+# With a template index, plans only have metrics with a trapper item in the zabbix templates
+
+import os
+import json
+import threading
+
+class awsServicesConfig:
+    # DynamoDB metrics with an Operation dimension
+    DYNAMODB_OPERATIONS_ALL = ['GetItem', 'PutItem', 'Query', 'Scan', 'UpdateItem', 'DeleteItem', 'BatchGetItem', 'BatchWriteItem']
+    DYNAMODB_OPERATIONS_RETURNED_ITEM = ['Query', 'Scan']
+    DYNAMODB_OPERATIONS_METRICS = ('SuccessfulRequestLatency', 'SystemErrors', 'ThrottledRequests')
+    DYNAMODB_RETURNED_ITEM_METRICS = ('ReturnedItemCount',)
+    # DynamoDB metrics of a global secondary index
+    DYNAMODB_INDEX_METRICS = ('OnlineIndexConsumedWriteCapacity', 'OnlineIndexPercentageProgress', 'OnlineIndexThrottleEvents')
+    # Dimension used as discovery item value in zabbix trapper keys of a service
+    DISCOVERY_DIMENSIONS = {'SQS': 'QueueName', 'SNS': 'TopicName'}
+
+    _config_file = None
+    _mtime = None
+    _metrics = None
+    _plans = None
+    _template_index = None
+    _template_plans = None
+    _template_version = None
+
+    def __init__(self, config_file, template_index=None):
+        self._config_file = config_file
+        # Index of the trapper keys of the zabbix templates, None to keep all configured metrics
+        self._template_index = template_index
+        self._lock = threading.Lock()
+
+    # Parse the configuration file again if it has been modified since it was read
+    def _reload(self):
+        mtime = os.stat(self._config_file).st_mtime
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    metrics = json.loads(open(self._config_file).read())
+                    self._plans = {}
+                    for aws_service in metrics:
+                        self._plans[aws_service] = self._compile(aws_service, metrics[aws_service])
+                    self._metrics = metrics
+                    self._template_plans = {}
+                    self._mtime = mtime
+
+    # Create a plan entry, templates are formatted with the account, region and dimensions of a resource
+    def _entry(self, metric_name, statistics, key_template, dimensions_template=None, requires=()):
+        return {
+            'metric': metric_name,
+            'statistics': statistics,
+            # Zabbix trapper key template
+            'key_template': key_template,
+            # Dimensions templates, None to use the dimensions of the resource
+            'dimensions_template': dimensions_template,
+            # Dimensions that must be set to query the metric
+            'requires': requires,
+        }
+
+    # Compile the metric plan of a service, a list of entries of each metric query
+    def _compile(self, aws_service, metrics):
+        plan = []
+        for metric in metrics:
+            metric_name = metric['metric']
+            statistics = metric['statistics']
+
+            if aws_service == 'DynamoDB':
+                # DynamoDB Item Key Format is different from the standard setup, due to combinations of different dimensions and metrics
+                if metric_name in self.DYNAMODB_OPERATIONS_METRICS + self.DYNAMODB_RETURNED_ITEM_METRICS:
+                    if metric_name in self.DYNAMODB_OPERATIONS_METRICS:
+                        operations = self.DYNAMODB_OPERATIONS_ALL
+                    else:
+                        operations = self.DYNAMODB_OPERATIONS_RETURNED_ITEM
+                    for op in operations:
+                        key_template = 'DynamoDB.' + op + '.' + metric_name + '.' + statistics + '["{account}","{region}","{TableName}"]'
+                        plan.append(self._entry(metric_name, statistics, key_template, {'TableName': '{TableName}', 'Operation': op}))
+                elif metric_name in self.DYNAMODB_INDEX_METRICS:
+                    key_template = 'DynamoDB.' + metric_name + '.' + statistics + '["{account}","{region}","{TableName}","{GlobalSecondaryIndexName}"]'
+                    plan.append(self._entry(metric_name, statistics, key_template, {'TableName': '{TableName}', 'GlobalSecondaryIndexName': '{GlobalSecondaryIndexName}'}, ('GlobalSecondaryIndexName',)))
+                else:
+                    key_template = 'DynamoDB.' + metric_name + '.' + statistics + '["{account}","{region}","{TableName}"]'
+                    plan.append(self._entry(metric_name, statistics, key_template, {'TableName': '{TableName}'}))
+            elif aws_service in self.DISCOVERY_DIMENSIONS:
+                # AWS Metric Zabbix Trapper Item Key Format with Discovery
+                key_template = aws_service + '.' + metric_name + '.' + statistics + '["{account}","{region}","{' + self.DISCOVERY_DIMENSIONS[aws_service] + '}"]'
+                plan.append(self._entry(metric_name, statistics, key_template))
+            else:
+                # AWS Metric Zabbix Trapper Item Key Format without Discovery
+                key_template = aws_service + '.' + metric_name + '.' + statistics
+                plan.append(self._entry(metric_name, statistics, key_template))
+        return plan
+
+    # Get the configured aws services
+    def getServices(self):
+        self._reload()
+        return self._metrics.keys()
+
+    # Get the configured metrics of a service, a list of dicts of metric and statistics
+    def getMetrics(self, aws_service):
+        self._reload()
+        return self._metrics[aws_service]
+
+    # Get the compiled metric plan of a service, only with the metrics of a zabbix template if it is given,
+    # otherwise with the metrics of all templates of the service
+    def getPlan(self, aws_service, template=None):
+        self._reload()
+        if self._template_index is None:
+            return self._plans[aws_service]
+        keys = self._template_index.getKeys(aws_service, template)
+        with self._lock:
+            if self._template_version != self._template_index.version:
+                self._template_plans = {}
+                self._template_version = self._template_index.version
+            plan = self._template_plans.get((aws_service, template))
+            if plan is None:
+                plan = self._plans[aws_service]
+                # Services without templates keep all configured metrics
+                if keys is not None:
+                    plan = [entry for entry in plan if self._template_index.keyName(entry['key_template']) in keys]
+                self._template_plans[(aws_service, template)] = plan
+        return plan
+
+    # Get cloudwatch metric queries of a resource by formatting the metric plan of its service
+    # A query is a dict of zabbix key, namespace, metric, statistics and dimensions
+    def getQueries(self, account, aws_region, aws_service, dimensions, template=None):
+        namespace = 'AWS/' + aws_service
+        params = dict(dimensions)
+        params['account'] = account
+        params['region'] = aws_region
+
+        queries = []
+        for entry in self.getPlan(aws_service, template):
+            if [name for name in entry['requires'] if not params.get(name)]:
+                continue
+            if entry['dimensions_template'] is None:
+                query_dimensions = dimensions
+            else:
+                query_dimensions = dict((name, value.format(**params)) for name, value in entry['dimensions_template'].items())
+            queries.append({
+                'zabbix_key': entry['key_template'].format(**params),
+                'namespace': namespace,
+                'metric': entry['metric'],
+                'statistics': entry['statistics'],
+                'dimensions': query_dimensions,
+            })
+        return queries
@@ -0,0 +1,53 @@
+# Description: A local stand-in for a boto cloudwatch connection, used by the benchmark
+# get_metric_statistics returns one datapoint per period of the time window, after a random latency,
+# and throttles a share of the requests like cloudwatch does when the api quota is exceeded
+
+import time
+import random
+import threading
+from datetime import timedelta
+from boto.exception import BotoServerError
+
+class cloudWatchStub:
+    THROTTLE_BODY = '<ErrorResponse><Error><Type>Sender</Type><Code>Throttling</Code><Message>Rate exceeded</Message></Error><RequestId>stub</RequestId></ErrorResponse>'
+
+    # Counters shared by all stub connections
+    _stats = {'connections': 0, 'calls': 0, 'throttles': 0, 'datapoints': 0}
+    _stats_lock = threading.Lock()
+
+    def __init__(self, latency=0.0, throttle_rate=0.0):
+        # Mean latency of a request in seconds, latencies are exponentially distributed
+        self._latency = latency
+        # Share of requests throttled, between 0 and 1
+        self._throttle_rate = throttle_rate
+        self._count('connections')
+
+    @classmethod
+    def _count(cls, name, n=1):
+        with cls._stats_lock:
+            cls._stats[name] += n
+
+    # Get and reset the counters of all stub connections
+    @classmethod
+    def resetStats(cls):
+        with cls._stats_lock:
+            stats = dict(cls._stats)
+            for name in cls._stats:
+                cls._stats[name] = 0
+        return stats
+
+    # get_metric_statistics(period, start_time, end_time, metric_name, namespace, statistics, dimensions=None, unit=None)
+    def get_metric_statistics(self, period, start_time, end_time, metric_name, namespace, statistics, dimensions=None, unit=None):
+        self._count('calls')
+        if self._latency:
+            time.sleep(random.expovariate(1.0 / self._latency))
+        if self._throttle_rate and random.random() < self._throttle_rate:
+            self._count('throttles')
+            raise BotoServerError(400, 'Bad Request', self.THROTTLE_BODY)
+        datapoints = []
+        timestamp = start_time
+        while timestamp < end_time:
+            datapoints.append({'Timestamp': timestamp, statistics: random.random() * 100, 'Unit': 'Count'})
+            timestamp += timedelta(seconds=int(period))
+        self._count('datapoints', len(datapoints))
+        return datapoints
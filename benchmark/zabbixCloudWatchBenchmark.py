@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+# Description: A benchmark of zabbixCloudWatch.py against a local cloudwatch stub and a fake zabbix trapper
+# Measures how wall-clock time, api calls, connections and memory grow with the number of resources
+# Example Usage: benchmark/zabbixCloudWatchBenchmark.py -n 10 -n 100 -n 1000 -n 10000 -l 0.005 -c 8
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import resource
+from datetime import datetime, timedelta
+from optparse import OptionParser
+
+base_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, base_path)
+
+import boto.ec2.cloudwatch
+import zabbixCloudWatch
+from cloudWatchStub import cloudWatchStub
+from zabbixTrapperStub import zabbixTrapperStub
+
+def config_parser():
+    parser = OptionParser(usage="usage: %prog [options]", version="%prog 1.0")
+    parser.add_option("-n", "--resources", dest="resources", action="append", help="number of resources, repeat to run several sizes, default 10, 100, 1000 and 10000", metavar="RESOURCES")
+    parser.add_option("-H", "--hosts", dest="hosts", default="10", help="number of zabbix hosts the resources are spread over, default 10", metavar="HOSTS")
+    parser.add_option("-p", "--period", dest="period", default="60", help="cloudwatch period in seconds, default 60", metavar="PERIOD")
+    parser.add_option("-w", "--window", dest="window", default="5", help="time window in minutes, default 5", metavar="WINDOW")
+    parser.add_option("-l", "--latency", dest="latency", default="0", help="mean latency of a cloudwatch request in seconds, default 0", metavar="LATENCY")
+    parser.add_option("-T", "--throttle", dest="throttle", default="0", help="share of cloudwatch requests throttled, between 0 and 1, default 0", metavar="THROTTLE")
+    parser.add_option("-z", "--zabbix-latency", dest="zabbixlatency", default="0", help="time in seconds the fake trapper takes to process a packet, default 0", metavar="ZABBIX_LATENCY")
+    parser.add_option("-k", "--keep-alive", dest="keepalive", action="store_true", default=False, help="the fake trapper keeps connections open, a zabbix server closes them after each response")
+    parser.add_option("-c", "--concurrency", dest="concurrency", default="1", help="number of concurrent cloudwatch requests, default 1", metavar="CONCURRENCY")
+    parser.add_option("-s", "--scenario", dest="scenarios", action="append", help="scenario to run, repeat to run several, default all", metavar="SCENARIO")
+    return parser
+
+# Get the value at a percentile of sorted values
+def percentile(v, p):
+    values = v
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+# Fetch cloudwatch data of SQS queues
+def benchGetCloudWatchData(i, context):
+    cw_data = zabbixCloudWatch.getCloudWatchData('aws_account_1', 'us-east-1', 'SQS', {'QueueName': 'bench-queue-%d' % i})
+    context['cw_data'][i] = cw_data
+    return 0
+
+# Fetch cloudwatch data of DynamoDB tables
+def benchGetCloudWatchDynamodbData(i, context):
+    zabbixCloudWatch.getCloudWatchDynamodbData('aws_account_1', 'us-east-1', 'DynamoDB', 'bench-table-%d' % i)
+    return 0
+
+# Send the latest datapoints of the SQS queues fetched by the first scenario
+def benchSendLatestCloudWatchData(i, context):
+    cw_data = context['cw_data'][i]
+    zabbixCloudWatch.sendLatestCloudWatchData('127.0.0.1', 'bench-host-%d' % (i % context['hosts']), cw_data)
+    return len(cw_data)
+
+# Send all datapoints of the SQS queues fetched by the first scenario, with a sent log per zabbix host
+def benchSendAllCloudWatchData(i, context):
+    cw_data = context['cw_data'][i]
+    zabbix_host = 'bench-host-%d' % (i % context['hosts'])
+    cw_log = os.path.join(context['tmp_dir'], zabbix_host + '.db')
+    zabbixCloudWatch.sendAllCloudWatchData('127.0.0.1', zabbix_host, cw_data, cw_log)
+    return sum(len(cwdata['cloud_watch_results']) for cwdata in cw_data)
+
+scenarios = [
+    ('getCloudWatchData', benchGetCloudWatchData),
+    ('getCloudWatchDynamodbData', benchGetCloudWatchDynamodbData),
+    ('sendLatestCloudWatchData', benchSendLatestCloudWatchData),
+    ('sendAllCloudWatchData', benchSendAllCloudWatchData),
+]
+
+# Run a scenario on a number of resources, one resource after the other like the cron jobs, returns a report line
+def runScenario(n, r, f, context, trapper):
+    scenario = n
+    resources = r
+    func = f
+
+    cloudWatchStub.resetStats()
+    trapper.resetStats()
+    latencies = []
+    started = time.time()
+    for i in range(resources):
+        resource_started = time.time()
+        func(i, context)
+        latencies.append(time.time() - resource_started)
+    elapsed = time.time() - started
+    latencies.sort()
+
+    cw_stats = cloudWatchStub.resetStats()
+    zabbix_stats = trapper.resetStats()
+    return '%-26s %6d %9.2f %10.1f %9.2f %9.2f %9.2f %9.2f %8d %7d %7d %8d %8d %8d' % (
+        scenario, resources, elapsed, resources / elapsed if elapsed else 0,
+        percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000, percentile(latencies, 99) * 1000, latencies[-1] * 1000,
+        cw_stats['calls'], cw_stats['throttles'], cw_stats['connections'],
+        zabbix_stats['connections'], zabbix_stats['items'],
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+if __name__ == '__main__':
+    parser = config_parser()
+    (options, args) = parser.parse_args()
+
+    sizes = [int(n) for n in options.resources or [10, 100, 1000, 10000]]
+    selected = options.scenarios or [name for name, func in scenarios]
+    latency = float(options.latency)
+    throttle_rate = float(options.throttle)
+
+    # Cloudwatch connections made by awsConnection are stub connections
+    boto.ec2.cloudwatch.connect_to_region = lambda *args, **kwargs: cloudWatchStub(latency, throttle_rate)
+    trapper = zabbixTrapperStub(float(options.zabbixlatency), options.keepalive)
+
+    # Settings of a cron run of zabbixCloudWatch.py
+    zabbixCloudWatch.zabbix_port = trapper.port()
+    zabbixCloudWatch.fetch_concurrency = int(options.concurrency)
+    zabbixCloudWatch.period = int(options.period)
+    zabbixCloudWatch.end_time = datetime.utcnow().replace(second=0, microsecond=0)
+    zabbixCloudWatch.start_time = zabbixCloudWatch.end_time - timedelta(minutes=int(options.window))
+    # Every resource is distinct, caching and metric listing would only hide the cost of fetching
+    zabbixCloudWatch.response_cache = zabbixCloudWatch.cloudWatchCache(ttl=0)
+    zabbixCloudWatch.metric_index = None
+
+    print '%-26s %6s %9s %10s %9s %9s %9s %9s %8s %7s %7s %8s %8s %8s' % (
+        'scenario', 'res', 'time_s', 'res/s', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms',
+        'cw_calls', 'thrott', 'cw_conn', 'zbx_conn', 'zbx_item', 'rss_mb')
+    for resources in sizes:
+        context = {'cw_data': {}, 'hosts': int(options.hosts), 'tmp_dir': tempfile.mkdtemp(prefix='zabbix-cloudwatch-bench.')}
+        try:
+            for name, func in scenarios:
+                if name not in selected:
+                    continue
+                # Send scenarios use the datapoints of the SQS queues
+                if name.startswith('send') and not context['cw_data']:
+                    runScenario('getCloudWatchData', resources, benchGetCloudWatchData, context, trapper)
+                print runScenario(name, resources, func, context, trapper)
+                sys.stdout.flush()
+        finally:
+            shutil.rmtree(context['tmp_dir'])
+
+    zabbixCloudWatch.closeConnections()
+    trapper.close()
@@ -0,0 +1,83 @@
+# Description: A local stand-in for a zabbix server trapper, used by the benchmark
+# It speaks the "ZBXD\1" protocol used by pyZabbixSender and accepts every item
+# Like a zabbix server it closes the connection after each response, unless keep alive is set
+
+import json
+import time
+import struct
+import threading
+import SocketServer
+
+class zabbixTrapperStub:
+    _server = None
+    _stats = None
+    _stats_lock = None
+
+    def __init__(self, latency=0.0, keep_alive=False):
+        # Time in seconds to process a packet
+        self._latency = latency
+        # Keep connections open as long as the sender does, instead of closing them after each response
+        self._keep_alive = keep_alive
+        self._stats = {'connections': 0, 'packets': 0, 'items': 0}
+        self._stats_lock = threading.Lock()
+
+        stub = self
+
+        class TrapperHandler(SocketServer.BaseRequestHandler):
+            def handle(self):
+                stub._count('connections')
+                while stub._handlePacket(self.request) and stub._keep_alive:
+                    pass
+
+        self._server = SocketServer.ThreadingTCPServer(('127.0.0.1', 0), TrapperHandler)
+        self._server.daemon_threads = True
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    # Port of the trapper, it listens on localhost
+    def port(self):
+        return self._server.server_address[1]
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self._stats[name] += n
+
+    # Get and reset the counters of the trapper
+    def resetStats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            for name in self._stats:
+                self._stats[name] = 0
+        return stats
+
+    def _recvAll(self, sock, length):
+        chunks = []
+        received = 0
+        while received < length:
+            chunk = sock.recv(length - received)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            received += len(chunk)
+        return ''.join(chunks)
+
+    # Read a packet and answer it, returns False when the sender closed the connection
+    def _handlePacket(self, sock):
+        header = self._recvAll(sock, 13)
+        if len(header) < 13 or header[:5] != 'ZBXD\1':
+            return False
+        data_length = struct.unpack('<q', header[5:])[0]
+        data = json.loads(self._recvAll(sock, data_length))
+        if self._latency:
+            time.sleep(self._latency)
+        items = len(data.get('data', []))
+        self._count('packets')
+        self._count('items', items)
+        response = json.dumps({'response': 'success', 'info': 'processed: %d; failed: 0; total: %d; seconds spent: 0.000100' % (items, items)})
+        sock.sendall('ZBXD\1' + struct.pack('<q', len(response)) + response)
+        return True
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
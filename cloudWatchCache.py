@@ -0,0 +1,157 @@
+# Description: A class to cache cloudwatch responses for a short time, so hosts monitoring the same resource share one fetch
+# Responses are kept in memory with LRU eviction, up to a max number of datapoints, and optionally in files of a cache directory,
+# so separate processes running in the same cycle share them too
+
+import os
+import json
+import time
+import errno
+import hashlib
+import calendar
+import threading
+from datetime import datetime
+from collections import OrderedDict
+
+class cloudWatchCache:
+    # Time to live of a cached response in seconds
+    TTL = 60
+    # Max number of datapoints of the responses kept in memory, about 100MB
+    MAX_DATAPOINTS = 200000
+
+    _ttl = TTL
+    _max_datapoints = MAX_DATAPOINTS
+    _cache_dir = None
+    _entries = None
+    _datapoints = 0
+    _last_expire = 0
+    _last_purge = 0
+
+    def __init__(self, ttl=TTL, max_datapoints=MAX_DATAPOINTS, cache_dir=None):
+        self._ttl = ttl
+        self._max_datapoints = max_datapoints
+        self._cache_dir = cache_dir
+        # Cached responses by key, least recently used first, with the time they were stored
+        self._entries = OrderedDict()
+        # Number of datapoints of the cached responses
+        self._datapoints = 0
+        self._lock = threading.Lock()
+        if cache_dir:
+            try:
+                os.makedirs(cache_dir)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    # Cache key of a metric query in a time window
+    def key(self, account, aws_region, query, period, start_time, end_time):
+        return (account, aws_region, query['namespace'], query['metric'], tuple(sorted(query['dimensions'].items())),
+                query['statistics'], int(period), start_time.isoformat(), end_time.isoformat())
+
+    def _cacheFile(self, key):
+        return os.path.join(self._cache_dir, hashlib.sha1(repr(key)).hexdigest() + '.json')
+
+    # Copy datapoints, so callers changing them don't change the cached ones
+    def _copy(self, results):
+        return [dict(datapoint) for datapoint in results]
+
+    # Get a copy of the cached datapoints of a key, None if they are not cached or expired
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and now - entry[0] < self._ttl:
+                self._entries[key] = entry
+                return self._copy(entry[1])
+        if self._cache_dir:
+            entry = self._readFile(key, now)
+            if entry is not None:
+                self._store(key, entry[1], entry[0])
+                return self._copy(entry[1])
+        return None
+
+    # Cache a copy of the datapoints of a key, expired responses are removed from memory
+    def put(self, key, results):
+        if self._ttl <= 0:
+            return
+        now = time.time()
+        results = self._copy(results)
+        self._store(key, results, now)
+        if now - self._last_expire > self._ttl:
+            self._last_expire = now
+            self._expire(now)
+        if self._cache_dir:
+            self._writeFile(key, results)
+            if now - self._last_purge > self._ttl:
+                self._last_purge = now
+                self.purge()
+
+    # Keep datapoints in memory, the least recently used responses are evicted beyond the max number of datapoints
+    # A response bigger than the max is not kept
+    def _store(self, key, results, stored_at):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._datapoints -= len(entry[1])
+            if len(results) > self._max_datapoints:
+                return
+            self._entries[key] = (stored_at, results)
+            self._datapoints += len(results)
+            while self._datapoints > self._max_datapoints:
+                key, entry = self._entries.popitem(last=False)
+                self._datapoints -= len(entry[1])
+
+    # Remove expired responses from memory
+    def _expire(self, now):
+        with self._lock:
+            for key, entry in self._entries.items():
+                if now - entry[0] >= self._ttl:
+                    del self._entries[key]
+                    self._datapoints -= len(entry[1])
+
+    # Read datapoints from the cache file of a key, timestamps are stored as UTC epoch seconds
+    # Returns the time they were stored and the datapoints, None if the file is missing or expired
+    # The time is read from the open file, the file may be replaced or purged by another process meanwhile
+    def _readFile(self, key, now):
+        try:
+            cache = open(self._cacheFile(key))
+            try:
+                stored_at = os.fstat(cache.fileno()).st_mtime
+                if now - stored_at >= self._ttl:
+                    return None
+                rows = json.loads(cache.read())
+            finally:
+                cache.close()
+        except (OSError, IOError, ValueError):
+            return None
+        results = []
+        for timestamp, datapoint in rows:
+            datapoint['Timestamp'] = datetime.utcfromtimestamp(timestamp)
+            results.append(datapoint)
+        return stored_at, results
+
+    # Write datapoints to the cache file of a key, the file is replaced atomically
+    def _writeFile(self, key, results):
+        cache_file = self._cacheFile(key)
+        rows = []
+        for result in results:
+            datapoint = dict((name, value) for name, value in result.items() if name != 'Timestamp')
+            rows.append((calendar.timegm(result['Timestamp'].utctimetuple()), datapoint))
+        tmp_file = '%s.%d.%d.tmp' % (cache_file, os.getpid(), threading.current_thread().ident)
+        try:
+            cache = open(tmp_file, 'w')
+            cache.write(json.dumps(rows))
+            cache.close()
+            os.rename(tmp_file, cache_file)
+        except (OSError, IOError):
+            pass
+
+    # Delete expired cache files
+    def purge(self):
+        now = time.time()
+        for name in os.listdir(self._cache_dir):
+            cache_file = os.path.join(self._cache_dir, name)
+            try:
+                if now - os.path.getmtime(cache_file) >= self._ttl:
+                    os.remove(cache_file)
+            except OSError:
+                pass
@@ -0,0 +1,54 @@
+# Description: A class to keep track of cloudwatch datapoints sent to zabbix
+# Sent datapoints are indexed by (zabbix_key, timestamp) in memory and stored in a sqlite file
+
+import time
+import sqlite3
+
+class cloudWatchLog:
+    _db = None
+    _sent = None
+    _pending = None
+
+    def __init__(self, log_file):
+        self._db = sqlite3.connect(log_file)
+        self._db.execute('CREATE TABLE IF NOT EXISTS sent (zabbix_key TEXT NOT NULL, clock INTEGER NOT NULL, value TEXT, sent_at INTEGER NOT NULL, PRIMARY KEY (zabbix_key, clock))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS sent_clock ON sent (clock)')
+        # Load the sent datapoints index
+        self._sent = set()
+        for zabbix_key, clock in self._db.execute('SELECT zabbix_key, clock FROM sent'):
+            self._sent.add((zabbix_key, clock))
+        # Datapoints marked as sent, but not committed yet
+        self._pending = []
+
+    # Check if a datapoint has been sent
+    def isSent(self, zabbix_key, clock):
+        return (zabbix_key, clock) in self._sent
+
+    # Mark a datapoint as sent, it is written to the log file on commit
+    def markSent(self, zabbix_key, clock, value):
+        self._sent.add((zabbix_key, clock))
+        self._pending.append((zabbix_key, clock, str(value), int(time.time())))
+
+    # Write datapoints marked as sent to the log file
+    def commit(self):
+        if self._pending:
+            self._db.executemany('INSERT OR REPLACE INTO sent (zabbix_key, clock, value, sent_at) VALUES (?, ?, ?, ?)', self._pending)
+            self._db.commit()
+        self._pending = []
+
+    # Forget datapoints marked as sent since the last commit, e.g. when the zabbix server is not reachable
+    def rollback(self):
+        for zabbix_key, clock, value, sent_at in self._pending:
+            self._sent.discard((zabbix_key, clock))
+        self._pending = []
+
+    # Remove datapoints older than max age in seconds
+    def purge(self, max_age):
+        oldest = int(time.time()) - max_age
+        self._db.execute('DELETE FROM sent WHERE clock < ?', (oldest,))
+        self._db.commit()
+        self._sent = set(key for key in self._sent if key[1] >= oldest)
+
+    def close(self):
+        self.commit()
+        self._db.close()
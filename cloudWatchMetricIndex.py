@@ -0,0 +1,95 @@
+# Description: A class to keep the metrics cloudwatch has for each resource, as listed by ListMetrics, for a time to live
+# A metric is a metric name and its dimensions, only metrics with data in the last two weeks are listed by cloudwatch
+# Listings are kept in memory, and in files of a cache directory, so separate processes (e.g. cron jobs) share them
+
+import os
+import json
+import time
+import errno
+import hashlib
+import threading
+
+class cloudWatchMetricIndex:
+    # Same directory as the resource listings cached by awsLLD.py
+    CACHE_DIR = '/var/tmp/zabbix-cloudwatch/metrics'
+    # Time to live of the metrics of a resource in seconds
+    TTL = 300
+    # Seconds cloudwatch can take to list a metric after its first datapoint
+    LIST_DELAY = 900
+
+    _ttl = TTL
+    _cache_dir = None
+    _resources = None
+
+    def __init__(self, ttl=TTL, cache_dir=CACHE_DIR):
+        self._ttl = ttl
+        self._cache_dir = cache_dir
+        # Metrics and the time they were listed, by resource
+        self._resources = {}
+        self._lock = threading.Lock()
+        if cache_dir:
+            try:
+                os.makedirs(cache_dir)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    # Key of a resource, the dimensions used to list its metrics
+    def key(self, account, aws_region, namespace, dimensions):
+        return (account, aws_region, namespace, frozenset(dimensions.items()))
+
+    def _indexFile(self, key):
+        account, aws_region, namespace, dimensions = key
+        return os.path.join(self._cache_dir, hashlib.sha1(repr((account, aws_region, namespace, sorted(dimensions)))).hexdigest() + '.json')
+
+    # Get the metrics of a resource, returns the time they were listed, None if the resource is not listed or expired,
+    # and its metrics, a set of (metric name, frozenset of dimensions), or None if the listing failed
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._resources.get(key)
+        if (entry is None or now - entry[0] >= self._ttl) and self._cache_dir:
+            entry = self._readFile(key)
+            if entry is not None:
+                with self._lock:
+                    self._resources[key] = entry
+        if entry is None or now - entry[0] >= self._ttl:
+            return None, None
+        return entry
+
+    # Keep the metrics of a resource, None if they could not be listed, returns the time they were listed
+    def put(self, key, metrics):
+        listed_at = time.time()
+        with self._lock:
+            self._resources[key] = (listed_at, metrics)
+        if self._cache_dir:
+            self._writeFile(key, listed_at, metrics)
+        return listed_at
+
+    # Read the listing of a resource from its file, None if there is none
+    def _readFile(self, key):
+        try:
+            listed_at, metrics = json.loads(open(self._indexFile(key)).read())
+        except (OSError, IOError, ValueError):
+            return None
+        if metrics is not None:
+            metrics = set((name, frozenset(tuple(dimension) for dimension in dimensions)) for name, dimensions in metrics)
+        return listed_at, metrics
+
+    # Write the listing of a resource to its file, the file is replaced atomically
+    def _writeFile(self, key, listed_at, metrics):
+        if metrics is not None:
+            metrics = [(name, sorted(dimensions)) for name, dimensions in metrics]
+        index_file = self._indexFile(key)
+        tmp_file = '%s.%d.%d.tmp' % (index_file, os.getpid(), threading.current_thread().ident)
+        try:
+            index = open(tmp_file, 'w')
+            index.write(json.dumps((listed_at, metrics)))
+            index.close()
+            os.rename(tmp_file, index_file)
+        except (OSError, IOError):
+            pass
+
+    # Check if a metric query has a metric in the listing of its resource
+    def exists(self, metrics, query):
+        return (query['metric'], frozenset(query['dimensions'].items())) in metrics
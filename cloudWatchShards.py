@@ -0,0 +1,80 @@
+# Description: A class to split the inventory between collector processes and nodes with consistent hashing
+# Members register a lease in a shared sqlite file and renew it every cycle, members whose lease expired are dropped.
+# Every member builds the same hash ring from the members with a lease, and only collects the targets it owns,
+# so a member joining or leaving only moves the targets between it and its neighbours on the ring
+
+import time
+import bisect
+import sqlite3
+import hashlib
+
+class cloudWatchShards:
+    # Points of each member on the hash ring, more points spread targets more evenly
+    VIRTUAL_NODES = 64
+
+    _db = None
+    _member = None
+    _lease_ttl = None
+    _ring = None
+    _points = None
+    _members = None
+
+    def __init__(self, lease_file, member, lease_ttl):
+        self._db = sqlite3.connect(lease_file, timeout=30)
+        self._db.execute('CREATE TABLE IF NOT EXISTS lease (member TEXT PRIMARY KEY, expires INTEGER NOT NULL)')
+        self._db.commit()
+        # Name of this member, unique among all collector processes and nodes
+        self._member = member
+        # Seconds a lease lasts without being renewed
+        self._lease_ttl = lease_ttl
+        self._ring = []
+        self._points = []
+        self._members = []
+
+    def _hash(self, value):
+        return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+    # Renew the lease of this member, drop expired leases, and rebuild the hash ring from the members with a lease
+    def renew(self):
+        now = int(time.time())
+        self._db.execute('INSERT OR REPLACE INTO lease (member, expires) VALUES (?, ?)', (self._member, now + self._lease_ttl))
+        self._db.execute('DELETE FROM lease WHERE expires < ?', (now,))
+        self._db.commit()
+        members = [row[0] for row in self._db.execute('SELECT member FROM lease ORDER BY member')]
+
+        ring = []
+        for member in members:
+            for i in range(self.VIRTUAL_NODES):
+                ring.append((self._hash('%s#%d' % (member, i)), member))
+        ring.sort()
+        self._ring = ring
+        self._points = [point for point, member in ring]
+        self._members = members
+        return members
+
+    # Get the member owning a key, the first member clockwise from the hash of the key on the ring
+    def owner(self, key):
+        if not self._ring:
+            return self._member
+        i = bisect.bisect(self._points, self._hash(key)) % len(self._ring)
+        return self._ring[i][1]
+
+    # Get the name of this member
+    def getMember(self):
+        return self._member
+
+    # Get the members with a lease at the last renewal
+    def getMembers(self):
+        return self._members
+
+    # Check if this member owns a key
+    def owns(self, key):
+        return self.owner(key) == self._member
+
+    # Give up the lease of this member, its targets move to the other members at their next cycle
+    def release(self):
+        self._db.execute('DELETE FROM lease WHERE member = ?', (self._member,))
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
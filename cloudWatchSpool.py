@@ -0,0 +1,209 @@
+# Description: A class to keep datapoints not delivered to zabbix on disk until they can be sent again
+# Each zabbix server has its own queue of append-only segment files in the spool directory,
+# one JSON line per batch of datapoints. The read position of a queue is kept in a cursor file,
+# segments are deleted once all their batches are delivered.
+# A queue can be shared by several processes, e.g. cron jobs: appends, reads and the cursor are serialised
+# by a lock file in the queue, and only one process at a time sends the batches of a queue.
+
+import os
+import sys
+import json
+import fcntl
+import errno
+import urllib
+
+class cloudWatchSpool:
+    # Size of a segment file before a new one is started
+    SEGMENT_SIZE = 8 * 1024 * 1024
+    # Max size of the queue of a zabbix server, the oldest segments are dropped beyond it
+    MAX_SIZE = 256 * 1024 * 1024
+
+    _spool_dir = None
+    _segment_size = SEGMENT_SIZE
+    _max_size = MAX_SIZE
+    _drain_locks = None
+
+    def __init__(self, spool_dir, segment_size=SEGMENT_SIZE, max_size=MAX_SIZE):
+        self._spool_dir = spool_dir
+        self._segment_size = segment_size
+        self._max_size = max_size
+        # Drain lock files held by this process, by zabbix server
+        self._drain_locks = {}
+        self._makeDirs(spool_dir)
+
+    # Create a directory, which can be created by another process at the same time
+    def _makeDirs(self, path):
+        try:
+            os.makedirs(path)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    # Directory of the queue of a zabbix server
+    def _queueDir(self, server):
+        return os.path.join(self._spool_dir, urllib.quote(server, ''))
+
+    # Lock the queue of a zabbix server, appends, reads and cursor updates are done with the lock held
+    def _lock(self, server):
+        self._makeDirs(self._queueDir(server))
+        lock = open(os.path.join(self._queueDir(server), 'lock'), 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    # Sequence numbers of the segment files of a zabbix server, oldest first
+    def _segments(self, server):
+        queue_dir = self._queueDir(server)
+        if not os.path.isdir(queue_dir):
+            return []
+        return sorted(int(name[:-6]) for name in os.listdir(queue_dir) if name.endswith('.spool'))
+
+    def _segmentFile(self, server, seq):
+        return os.path.join(self._queueDir(server), '%010d.spool' % seq)
+
+    # Read the position of the next batch to send, a segment sequence number and an offset in the segment
+    def _readCursor(self, server):
+        try:
+            seq, offset = open(os.path.join(self._queueDir(server), 'cursor')).read().split()
+            return int(seq), int(offset)
+        except (IOError, ValueError):
+            return 0, 0
+
+    # Write the position of the next batch to send, the cursor file is replaced atomically
+    def _writeCursor(self, server, seq, offset):
+        cursor_file = os.path.join(self._queueDir(server), 'cursor')
+        cursor = open(cursor_file + '.tmp', 'w')
+        cursor.write('%d %d\n' % (seq, offset))
+        cursor.flush()
+        os.fsync(cursor.fileno())
+        cursor.close()
+        os.rename(cursor_file + '.tmp', cursor_file)
+
+    # Get the sequence number of the segment to append to, a new segment is started when the last one is full,
+    # or when it ends with a batch cut short by a crash, so that batch is never continued
+    def _appendSegment(self, server):
+        segments = self._segments(server)
+        if segments:
+            segment_file = self._segmentFile(server, segments[-1])
+            size = os.path.getsize(segment_file)
+            if size == 0:
+                return segments[-1]
+            if size < self._segment_size:
+                segment = open(segment_file, 'rb')
+                segment.seek(-1, os.SEEK_END)
+                complete = segment.read(1) == '\n'
+                segment.close()
+                if complete:
+                    return segments[-1]
+        return max(segments + [self._readCursor(server)[0]]) + 1
+
+    # Drop the oldest segments of a zabbix server while its queue is bigger than the max size
+    def _trim(self, server):
+        segments = self._segments(server)
+        size = sum(os.path.getsize(self._segmentFile(server, seq)) for seq in segments)
+        while size > self._max_size and len(segments) > 1:
+            seq = segments.pop(0)
+            segment_file = self._segmentFile(server, seq)
+            size -= os.path.getsize(segment_file)
+            os.remove(segment_file)
+            print >> sys.stderr, 'Spool full, dropped segment %s' % segment_file
+
+    # Append a batch of datapoints of a zabbix server, datapoints are dicts of host, key, value and clock
+    # The batch is synced to disk before the queue is unlocked, so other processes never read a partial batch
+    def append(self, server, data_points):
+        if not data_points:
+            return
+        batch = [[d['host'], d['key'], d['value'], d.get('clock', 0)] for d in data_points]
+        line = json.dumps(batch) + '\n'
+        lock = self._lock(server)
+        try:
+            writer = open(self._segmentFile(server, self._appendSegment(server)), 'ab')
+            try:
+                writer.write(line)
+                writer.flush()
+                os.fsync(writer.fileno())
+            finally:
+                writer.close()
+            self._trim(server)
+        finally:
+            lock.close()
+
+    # Zabbix servers with datapoints waiting to be sent
+    def servers(self):
+        servers = []
+        for name in os.listdir(self._spool_dir):
+            if not os.path.isdir(os.path.join(self._spool_dir, name)):
+                continue
+            server = urllib.unquote(name)
+            if self.peek(server, 1)[0]:
+                servers.append(server)
+        return servers
+
+    # Take the right to send the batches of a zabbix server, returns False if another process is sending them
+    # It is held until release, so two processes never send the same batches
+    def acquire(self, server):
+        if server in self._drain_locks:
+            return True
+        self._makeDirs(self._queueDir(server))
+        lock = open(os.path.join(self._queueDir(server), 'drain.lock'), 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError, e:
+            lock.close()
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        self._drain_locks[server] = lock
+        return True
+
+    # Give up the right to send the batches of a zabbix server
+    def release(self, server):
+        lock = self._drain_locks.pop(server, None)
+        if lock is not None:
+            lock.close()
+
+    # Get the oldest batches of a zabbix server, until at least max_points datapoints are read
+    # Returns the datapoints and the position after them, to pass to ack once they are delivered
+    def peek(self, server, max_points):
+        data_points = []
+        lock = self._lock(server)
+        try:
+            segments = self._segments(server)
+            seq, offset = self._readCursor(server)
+            for segment_seq in segments:
+                if segment_seq < seq:
+                    continue
+                if segment_seq > seq:
+                    seq, offset = segment_seq, 0
+                segment = open(self._segmentFile(server, seq), 'rb')
+                segment.seek(offset)
+                for line in iter(segment.readline, ''):
+                    offset += len(line)
+                    if not line.endswith('\n'):
+                        # The last batch of a segment cut short by a crash, appends never continue it
+                        print >> sys.stderr, 'Spool skipped a partial batch in %s' % self._segmentFile(server, seq)
+                        continue
+                    for host, key, value, clock in json.loads(line):
+                        data_points.append({'host': host, 'key': key, 'value': value, 'clock': clock})
+                    if len(data_points) >= max_points:
+                        segment.close()
+                        return data_points, (seq, offset)
+                segment.close()
+        finally:
+            lock.close()
+        return data_points, (seq, offset)
+
+    # Mark the batches before a position returned by peek as delivered, and delete delivered segments
+    def ack(self, server, position):
+        seq, offset = position
+        lock = self._lock(server)
+        try:
+            self._writeCursor(server, seq, offset)
+            for segment_seq in self._segments(server):
+                if segment_seq < seq:
+                    os.remove(self._segmentFile(server, segment_seq))
+        finally:
+            lock.close()
+
+    def close(self):
+        for server in self._drain_locks.keys():
+            self.release(server)
@@ -0,0 +1,60 @@
+# Description: A class to collect timings and counters of a collector cycle, to monitor the collector in zabbix
+# Timings of each phase are summarised as p50, p95 and max, timings and counters are reset every cycle
+
+import time
+import threading
+
+class cloudWatchStats:
+    # Percentiles of the timings of a phase sent to zabbix
+    PERCENTILES = (('p50', 50), ('p95', 95))
+
+    _timings = None
+    _counters = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    # Remove all timings and counters
+    def reset(self):
+        with self._lock:
+            # Durations in seconds by phase
+            self._timings = {}
+            self._counters = {}
+
+    # Add the duration in seconds of a phase
+    def addTiming(self, phase, seconds):
+        with self._lock:
+            self._timings.setdefault(phase, []).append(seconds)
+
+    # Call a function and add its duration to a phase
+    def timed(self, phase, func, *args, **kwargs):
+        started = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.addTiming(phase, time.time() - started)
+
+    # Add to a counter
+    def count(self, counter, n=1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + n
+
+    # Get the summary of the cycle, a dict of zabbix trapper keys and values
+    # zabbixCloudWatch.time[<phase>,<p50|p95|max|count>] and zabbixCloudWatch.count[<counter>],
+    # with the member name as last parameter if it is given, so collectors sharing a monitor host send distinct keys
+    def summary(self, counters=(), member=None):
+        with self._lock:
+            timings = dict((phase, sorted(seconds)) for phase, seconds in self._timings.items())
+            values = dict((counter, 0) for counter in counters)
+            values.update(self._counters)
+        suffix = ',' + member if member is not None else ''
+        items = {}
+        for phase, seconds in timings.items():
+            for name, p in self.PERCENTILES:
+                items['zabbixCloudWatch.time[%s,%s%s]' % (phase, name, suffix)] = seconds[min(len(seconds) - 1, len(seconds) * p // 100)]
+            items['zabbixCloudWatch.time[%s,max%s]' % (phase, suffix)] = seconds[-1]
+            items['zabbixCloudWatch.time[%s,count%s]' % (phase, suffix)] = len(seconds)
+        for counter, value in values.items():
+            items['zabbixCloudWatch.count[%s%s]' % (counter, suffix)] = value
+        return items
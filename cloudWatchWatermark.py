@@ -0,0 +1,58 @@
+# Description: A class to keep the timestamp of the last cloudwatch datapoint delivered to zabbix for each zabbix host and key
+# Keys of services without discovery are the same for every resource, so watermarks are kept by zabbix host too
+# Timestamps are stored in a sqlite file as UTC epoch seconds
+
+import sqlite3
+import calendar
+from datetime import datetime
+
+class cloudWatchWatermark:
+    _db = None
+    _watermark_file = None
+    _watermarks = None
+
+    def __init__(self, watermark_file):
+        self._watermark_file = watermark_file
+        self._db = sqlite3.connect(watermark_file, timeout=30)
+        # Watermarks of the first versions were kept by zabbix key only, they can't be told apart by host
+        columns = [row[1] for row in self._db.execute('PRAGMA table_info(watermark)')]
+        if columns and 'zabbix_host' not in columns:
+            self._db.execute('DROP TABLE watermark')
+        self._db.execute('CREATE TABLE IF NOT EXISTS watermark (zabbix_host TEXT NOT NULL, zabbix_key TEXT NOT NULL, timestamp INTEGER NOT NULL, PRIMARY KEY (zabbix_host, zabbix_key))')
+        self._db.commit()
+        self._load()
+
+    # Load all watermarks
+    def _load(self):
+        self._watermarks = {}
+        for zabbix_host, zabbix_key, timestamp in self._db.execute('SELECT zabbix_host, zabbix_key, timestamp FROM watermark'):
+            self._watermarks[(zabbix_host, zabbix_key)] = timestamp
+
+    # Reopen the watermark file and load the watermarks written by other processes since it was opened,
+    # e.g. in a forked collector process or when targets move between collector processes
+    def reload(self):
+        self._db.close()
+        self._db = sqlite3.connect(self._watermark_file, timeout=30)
+        self._load()
+
+    # Get the UTC timestamp of the last datapoint delivered for a key of a zabbix host, None if nothing was delivered
+    def get(self, zabbix_host, zabbix_key):
+        timestamp = self._watermarks.get((zabbix_host, zabbix_key))
+        if timestamp is None:
+            return None
+        return datetime.utcfromtimestamp(timestamp)
+
+    # Move watermarks forward, updates is a dict of (zabbix host, zabbix key) and UTC timestamp of the last delivered datapoint
+    def update(self, updates):
+        rows = []
+        for (zabbix_host, zabbix_key), utc_timestamp in updates.items():
+            timestamp = calendar.timegm(utc_timestamp.timetuple())
+            if timestamp > self._watermarks.get((zabbix_host, zabbix_key), 0):
+                self._watermarks[(zabbix_host, zabbix_key)] = timestamp
+                rows.append((zabbix_host, zabbix_key, timestamp))
+        if rows:
+            self._db.executemany('INSERT OR REPLACE INTO watermark (zabbix_host, zabbix_key, timestamp) VALUES (?, ?, ?)', rows)
+            self._db.commit()
+
+    def close(self):
+        self._db.close()
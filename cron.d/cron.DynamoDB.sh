@@ -30,9 +30,12 @@ STARTTIME=$(date -u "+%F %H:%M:00" -d "20 minutes ago")
 TABLES=$(awsLLD.py -a "$ACCOUNT" -r "$REGION" -q "DynamoDBTables" -c "$COMPONENT" | jq '.data[]["{#TABLE_NAME}"]' | xargs)
 
 if [ -n "$TABLES" ]; then
+  # Collect cloudwatch data of all tables in one process
+  DIMENSIONS=()
   for table in $TABLES
     do
-    # Send cloudwatch data of a table to Zabbix Server
-    zabbixCloudWatch.py -z "$ZABBIX_SERVER" -x "$ZABBIX_HOST" -a "$ACCOUNT" -r "$REGION" -s "DynamoDB" -d "TableName=$table" -p "$PERIOD" -f "$STARTTIME" -t "$ENDTIME"
+      DIMENSIONS+=(-d "TableName=$table")
   done
+  # Send cloudwatch data of the tables to Zabbix Server
+  zabbixCloudWatch.py -z "$ZABBIX_SERVER" -x "$ZABBIX_HOST" -a "$ACCOUNT" -r "$REGION" -s "DynamoDB" "${DIMENSIONS[@]}" -p "$PERIOD" -f "$STARTTIME" -t "$ENDTIME"
 fi
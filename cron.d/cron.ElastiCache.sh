@@ -17,6 +17,8 @@ ZABBIX_SERVER=$3
 ACCOUNT=$4
 # AWS Region
 REGION=$5
+# ElastiCache engine, redis or memcached, only metrics of the template of the engine are sent
+ENGINE=$6
 # Collecting 5-minute data from cloudwatch
 PERIOD="300"
 # Set start time and end time for collecting cloudwatch data
@@ -25,4 +27,8 @@ ENDTIME=$(date -u "+%F %H:%M:00" -d "5 minutes ago")
 STARTTIME=$(date -u "+%F %H:%M:00" -d "10 minutes ago")
 
 # Send cloudwatch data of a table to Zabbix Server
-zabbixCloudWatch.py -z "$ZABBIX_SERVER" -x "$ZABBIX_HOST" -a "$ACCOUNT" -r "$REGION" -s "ElastiCache" -d "CacheClusterId=$CLUSTER_ID" -p "$PERIOD" -f "$STARTTIME" -t "$ENDTIME"
+if [ -n "$ENGINE" ]; then
+    zabbixCloudWatch.py -z "$ZABBIX_SERVER" -x "$ZABBIX_HOST" -a "$ACCOUNT" -r "$REGION" -s "ElastiCache" -d "CacheClusterId=$CLUSTER_ID" -e "Template AWS ElastiCache:$ENGINE" -p "$PERIOD" -f "$STARTTIME" -t "$ENDTIME"
+else
+    zabbixCloudWatch.py -z "$ZABBIX_SERVER" -x "$ZABBIX_HOST" -a "$ACCOUNT" -r "$REGION" -s "ElastiCache" -d "CacheClusterId=$CLUSTER_ID" -p "$PERIOD" -f "$STARTTIME" -t "$ENDTIME"
+fi
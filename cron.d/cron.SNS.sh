@@ -30,9 +30,12 @@ STARTTIME=$(date -u "+%F %H:%M:00" -d "10 minutes ago")
 TOPICS=$(awsLLD.py -a "$ACCOUNT" -r "$REGION" -q "SNSTopics" -c "$COMPONENT" | jq '.data[]["{#TOPIC_NAME}"]' | xargs)
 
 if [ -n "$TOPICS" ]; then
+  # Collect cloudwatch data of all topics in one process
+  DIMENSIONS=()
   for topic in $TOPICS
     do
-      # Send cloudwatch data of a table to Zabbix Server
-      zabbixCloudWatch.py -z "$ZABBIX_SERVER" -x "$ZABBIX_HOST" -a "$ACCOUNT" -r "$REGION" -s "SNS" -d "TopicName=$topic" -p "$PERIOD" -f "$STARTTIME" -t "$ENDTIME"
+      DIMENSIONS+=(-d "TopicName=$topic")
   done
+  # Send cloudwatch data of the topics to Zabbix Server
+  zabbixCloudWatch.py -z "$ZABBIX_SERVER" -x "$ZABBIX_HOST" -a "$ACCOUNT" -r "$REGION" -s "SNS" "${DIMENSIONS[@]}" -p "$PERIOD" -f "$STARTTIME" -t "$ENDTIME"
 fi
@@ -38,9 +38,12 @@ else
 fi
 
 if [ -n "$QUEUES" ]; then
+  # Collect cloudwatch data of all queues in one process
+  DIMENSIONS=()
   for queue in $QUEUES
     do
-      # Send cloudwatch data of a table to Zabbix Server
-      zabbixCloudWatch.py -z "$ZABBIX_SERVER" -x "$ZABBIX_HOST" -a "$ACCOUNT" -r "$REGION" -s "SQS" -d "QueueName=$queue" -p "$PERIOD" -f "$STARTTIME" -t "$ENDTIME"
+      DIMENSIONS+=(-d "QueueName=$queue")
   done
+  # Send cloudwatch data of the queues to Zabbix Server
+  zabbixCloudWatch.py -z "$ZABBIX_SERVER" -x "$ZABBIX_HOST" -a "$ACCOUNT" -r "$REGION" -s "SQS" "${DIMENSIONS[@]}" -p "$PERIOD" -f "$STARTTIME" -t "$ENDTIME"
 fi
@@ -6,10 +6,13 @@
 # License: GNU GPLv2
 
 import socket
+import select
 import struct
 import time
 import sys
 import re
+import itertools
+from array import array
 
 # If you're using an old version of python that don't have json available,
 # you can use simplejson instead: https://simplejson.readthedocs.org/en/latest/
@@ -32,8 +35,12 @@ class pyZabbixSender:
     RC_ERR_CONN      = 255  # Error talking to the server
     RC_ERR_INV_RESP  = 254  # Invalid response from server
 
+    # Max size of a packet accepted by zabbix server, header included
+    MAX_PACKET_SIZE = 128 * 1024 * 1024
+    # Size of the zabbix protocol header: "ZBXD", protocol version and data length
+    HEADER_SIZE = 13
     
-    def __init__(self, server=ZABBIX_SERVER, port=ZABBIX_PORT, verbose=False):
+    def __init__(self, server=ZABBIX_SERVER, port=ZABBIX_PORT, verbose=False, persistent=False, pool_size=1, max_packet_size=MAX_PACKET_SIZE):
         '''
         #####Description:
         This is the constructor, to obtain an object of type pyZabbixSender, linked to work with a specific server/port.
@@ -41,6 +48,9 @@ class pyZabbixSender:
         * **server**: [in] [string] [optional] This is the server domain name or IP. *Default value: "127.0.0.1"*
         * **port**: [in] [integer] [optional] This is the port open in the server to receive zabbix traps. *Default value: 10051*
         * **verbose**: [in] [boolean] [optional] This is to allow the library to write some output to stderr when finds an error. *Default value: False*
+        * **persistent**: [in] [boolean] [optional] Keep connections to the server open after a send, and reuse them for the next sends. Connections closed by the server are detected and reopened. Please note that Zabbix server closes the connection after each response, so connections are only reused with servers keeping them open. *Default value: False*
+        * **pool_size**: [in] [integer] [optional] Max number of open connections kept by a persistent sender. *sendData* sends up to *pool_size* packets before reading their responses, one packet per connection. *Default value: 1*
+        * **max_packet_size**: [in] [integer] [optional] Max size in bytes of a packet sent by *sendData*, data is split in several packets to stay within this size. *Default value: 128MB, the max size accepted by zabbix server*
         **Note: The "verbose" parameter will be revisited and could be removed/replaced in the future**
         #####Return:
         It returns a pyZabbixSender object.
@@ -49,14 +59,22 @@ class pyZabbixSender:
         self.zport   = port
         self.verbose = verbose
         self.timeout = 5         # Socket connection timeout.
-        self.__data = []         # This is to store data to be sent later.
+        self.clearData()         # This is to store data to be sent later.
+        self.persistent = persistent
+        self.pool_size = max(1, int(pool_size))
+        self.__pool = []         # Open connections kept by a persistent sender.
+        self.max_packet_size = max_packet_size
+        self.__encoder = json.JSONEncoder()
+        self.__buffers = [bytearray() for i in range(self.pool_size)]  # Packet buffers reused between sends.
+        self.__packet_counts = []  # Number of data points of each packet of the last send.
+        self.__undelivered = None  # Data points not delivered by the last sendDataRetry.
 
         
     def __str__(self):
         '''
         This allows you to obtain a string representation of the internal data
         '''
-        return str(self.__data)
+        return str(self.getData())
         
         
     def __createDataPoint(self, host, key, value, clock=None):
@@ -73,34 +91,167 @@ class pyZabbixSender:
         return obj
 
         
-    def __send(self, mydata):
+    def __connect(self):
         '''
-        This is the method that actually sends the data to the zabbix server.
+        Opens a new connection to the zabbix server.
+        '''
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect((self.zserver, self.zport))
+        return sock
+
+
+    def __isAlive(self, sock):
+        '''
+        Checks if a pooled connection is still open. A connection closed by the server is readable and returns no data.
         '''
-        socket.setdefaulttimeout(self.timeout)
-        data_length = len(mydata)
-        data_header = str(struct.pack('q', data_length))
-        data_to_send = 'ZBXD\1' + str(data_header) + str(mydata)
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((self.zserver, self.zport))
-            sock.send(data_to_send)
-        except Exception, err:
-            err_message = u'Error talking to server: %s\n' %str(err)
-            sys.stderr.write(err_message)
-            return self.RC_ERR_CONN, err_message
+            readable, writable, failed = select.select([sock], [], [sock], 0)
+            if failed:
+                return False
+            if readable:
+                return sock.recv(1, socket.MSG_PEEK) != ''
+            return True
+        except (socket.error, select.error):
+            return False
+
+
+    def __getSocket(self):
+        '''
+        Returns an open connection from the pool, or a new one. The second value tells if the connection was reused.
+        '''
+        while self.__pool:
+            sock = self.__pool.pop()
+            if self.__isAlive(sock):
+                return sock, True
+            sock.close()
+        return self.__connect(), False
+
+
+    def __releaseSocket(self, sock):
+        '''
+        Keeps a connection in the pool of a persistent sender, otherwise closes it.
+        '''
+        if self.persistent and len(self.__pool) < self.pool_size:
+            self.__pool.append(sock)
+        else:
+            sock.close()
+
+
+    def __recvAll(self, sock, length):
+        '''
+        Reads exactly "length" bytes from a connection, or less if the connection is closed.
+        '''
+        chunks = []
+        received = 0
+        while received < length:
+            chunk = sock.recv(length - received)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            received += len(chunk)
+        return ''.join(chunks)
+
+
+    def __buildPackets(self, data, packet_clock=None, max_data_per_conn=None, counts=None):
+        '''
+        Serialises data points one by one into packets with the zabbix protocol header, and yields a memoryview of each packet.
+        A packet is closed when it holds *max_data_per_conn* data points, or when the next data point would make it bigger than *max_packet_size*.
+        Packets are built in buffers reused between packets, up to *pool_size* packets can be in use at the same time.
+        The number of data points of each packet is appended to *counts* if it is given.
+        '''
+        max_packet_size = self.max_packet_size
+        encode = self.__encoder.encode
+        opening = '{"request": "sender data", "data": ['
+        if packet_clock:
+            closing = '], "clock": %s}' % encode(packet_clock)
+        else:
+            closing = ']}'
+        n = 0
+        buf = None
+        count = 0
+        for data_point in data:
+            item = encode(data_point)
+            if buf is not None and (count == max_data_per_conn or len(buf) + 2 + len(item) + len(closing) > max_packet_size):
+                buf += closing
+                struct.pack_into('<q', buf, 5, len(buf) - self.HEADER_SIZE)
+                if counts is not None:
+                    counts.append(count)
+                yield memoryview(buf)
+                buf = None
+            if buf is None:
+                buf = self.__buffers[n % self.pool_size]
+                try:
+                    del buf[:]
+                except BufferError:
+                    # The previous packet of this buffer is still referenced somewhere, use a new buffer
+                    buf = self.__buffers[n % self.pool_size] = bytearray()
+                n += 1
+                count = 0
+                buf += 'ZBXD\1\0\0\0\0\0\0\0\0'
+                buf += opening
+            else:
+                buf += ', '
+            buf += item
+            count += 1
+        if buf is not None:
+            buf += closing
+            struct.pack_into('<q', buf, 5, len(buf) - self.HEADER_SIZE)
+            if counts is not None:
+                counts.append(count)
+            yield memoryview(buf)
+
+
+    def __sendPacket(self, data_to_send):
+        '''
+        Sends a packet on a pooled or new connection, and returns the connection to read the response from and if it was reused.
+        A reused connection can be closed by the server at any time, then the packet is sent again on a new connection.
+        '''
+        sock, reused = self.__getSocket()
+        try:
+            sock.sendall(data_to_send)
+        except socket.error:
+            sock.close()
+            if not reused:
+                raise
+            sock, reused = self.__connect(), False
+            sock.sendall(data_to_send)
+        return sock, reused
+
 
-        response_header = sock.recv(5)
+    def __readResponse(self, sock, mydata, reused=False):
+        '''
+        Reads and parses the server response to a packet sent on a connection.
+        A reused connection closed by the server before answering raises a socket error, so the packet can be sent again.
+        '''
+        response_header = self.__recvAll(sock, 5)
+        if reused and response_header == '':
+            sock.close()
+            raise socket.error('Connection closed by server')
         if not response_header == 'ZBXD\1':
-            err_message = u'Invalid response from server. Malformed data?\n---\n%s\n---\n' % str(mydata)
+            sock.close()
+            err_message = u'Invalid response from server. Malformed data?\n---\n%s\n---\n' % mydata[self.HEADER_SIZE:].tobytes()
             sys.stderr.write(err_message)
             return self.RC_ERR_INV_RESP, err_message
 
-        response_data_header = sock.recv(8)
+        response_data_header = self.__recvAll(sock, 8)
         response_data_header = response_data_header[:4]
         response_len = struct.unpack('i', response_data_header)[0]
-        response_raw = sock.recv(response_len)
-        sock.close()
+        response_raw = self.__recvAll(sock, response_len)
+        self.__releaseSocket(sock)
+        return self.parseResponse(response_raw, mydata)
+
+
+    def parseResponse(self, response_raw, mydata):
+        '''
+        #####Description:
+        Parses the data of a server response, without the protocol header, to a packet.
+        #####Parameters:
+        * **response_raw**: [in] [string] [mandatory] The data of the response.
+        * **mydata**: [in] [memoryview] [mandatory] The packet the server responded to, as returned by *getPackets*.
+        #####Return:
+        The return code and the message returned by the server.
+        '''
         response = json.loads(response_raw)
         match = re.match('^.*failed.+?(\d+).*$', response['info'].lower() if 'info' in response else '')
         if match is None:
@@ -111,12 +262,111 @@ class pyZabbixSender:
             fails = int(match.group(1))
             if fails > 0:
                 if self.verbose is True:
-                    err_message = u'Failures reported by zabbix when sending:\n%s\n' % str(mydata)
+                    err_message = u'Failures reported by zabbix when sending:\n%s\n' % mydata[self.HEADER_SIZE:].tobytes()
                     sys.stderr.write(err_message)
                 return self.RC_ERR_FAIL_SEND, response
         return self.RC_OK, response
 
 
+    def __sendMany(self, packets):
+        '''
+        Sends several packets, up to *pool_size* packets are sent on separate connections before reading their responses.
+        Packets are taken from an iterable as they are sent, so only *pool_size* packets are built at the same time.
+        '''
+        responses = []
+        packets = iter(packets)
+        while True:
+            pending = []
+            for mydata in packets:
+                try:
+                    sock, reused = self.__sendPacket(mydata)
+                    pending.append((sock, reused, mydata, None))
+                except Exception, err:
+                    pending.append((None, False, mydata, err))
+                if len(pending) == self.pool_size:
+                    break
+            if not pending:
+                break
+            for sock, reused, mydata, err in pending:
+                if sock is not None:
+                    try:
+                        try:
+                            responses.append(self.__readResponse(sock, mydata, reused))
+                        except socket.error:
+                            if not reused:
+                                raise
+                            # The reused connection was closed by the server, send again on a new connection
+                            sock = self.__connect()
+                            sock.sendall(mydata)
+                            responses.append(self.__readResponse(sock, mydata))
+                        continue
+                    except Exception, err:
+                        sock.close()
+                err_message = u'Error talking to server: %s\n' %str(err)
+                sys.stderr.write(err_message)
+                responses.append((self.RC_ERR_CONN, err_message))
+            # Drop references to the sent packets, so their buffers can be reused
+            pending = mydata = None
+        return responses
+
+
+    def __send(self, mydata):
+        '''
+        This is the method that actually sends the data to the zabbix server.
+        '''
+        return self.__sendMany([mydata])[0]
+
+
+    def close(self):
+        '''
+        #####Description:
+        Closes all open connections kept by a persistent sender. New connections are opened on the next send.
+        #####Parameters:
+        None
+        #####Return:
+        None
+        '''
+        while self.__pool:
+            self.__pool.pop().close()
+
+
+    def getPackets(self, packet_clock=None, max_data_per_conn=None):
+        '''
+        #####Description:
+        Iterates over the packets *sendData* would send, to send them with another connection handler. Packets are built when they are reached.
+        Packet buffers are reused, up to *pool_size* packets can be in use at the same time.
+        #####Parameters:
+        It shares the same parameters as the *sendData* method.
+        #####Return:
+        An iterator of packets, each one a memoryview of the packet with the protocol header.
+        '''
+        self.__compact()
+        data = (data_point for index, data_point in self.iterData())
+        self.__packet_counts = []
+        self.__undelivered = None
+        return self.__buildPackets(data, packet_clock, max_data_per_conn, self.__packet_counts)
+
+
+    def undeliveredData(self, responses):
+        '''
+        #####Description:
+        Gets the data points of the last send that didn't reach the Zabbix server, to keep them and send them again later.
+        #####Parameters:
+        * **responses**: [in] [list] [mandatory] A list of *(return_code, msg_from_server)* of each packet of *getPackets* or *sendData*, as returned by *sendData*. It is ignored after *sendDataRetry*.
+        #####Return:
+        The list of data points of the packets with a connection error or an invalid response, or without a response.
+        '''
+        if self.__undelivered is not None:
+            return list(self.__undelivered)
+        undelivered = []
+        data = self.iterData()
+        for i, count in enumerate(self.__packet_counts):
+            packet_data = [data_point for index, data_point in itertools.islice(data, count)]
+            if i >= len(responses) or responses[i][0] in (self.RC_ERR_CONN, self.RC_ERR_INV_RESP):
+                undelivered.extend(packet_data)
+        return undelivered
+
+
     def addData(self, host, key, value, clock=None):
         '''
         #####Description:
@@ -133,8 +383,12 @@ class pyZabbixSender:
         #####Return:
         This method doesn't have a return.
         '''
-        obj = self.__createDataPoint(host, key, value, clock)
-        self.__data.append(obj)
+        self.__hosts.append(self.__strings.setdefault(host, host))
+        self.__keys.append(self.__strings.setdefault(key, key))
+        self.__values.append(value)
+        # Clocks are stored as integers, a float or string timestamp is truncated to the second
+        self.__clocks.append(int(clock) if clock else 0)
+        self.__count += 1
 
         
     def clearData(self):
@@ -146,8 +400,41 @@ class pyZabbixSender:
         #####Return:
         None
         '''
-        self.__data = []
-        
+        # Data points are stored in columns, a removed data point keeps its index with None as host until the next send
+        self.__hosts = []
+        self.__keys = []
+        self.__values = []
+        self.__clocks = array('l')
+        self.__count = 0
+        # Hosts and keys are shared by all data points using them
+        self.__strings = {}
+
+
+    def __len__(self):
+        '''
+        Returns the number of data points stored in the object.
+        '''
+        return self.__count
+
+
+    def iterData(self):
+        '''
+        #####Description:
+        Iterates over the internal data without copying it. Each data point is built when it is reached, changing it doesn't change the internal data.
+        #####Parameters:
+        None
+        #####Return:
+        An iterator of *(index, data_point)*, the index can be passed to *removeDataPointAt*.
+        '''
+        hosts = self.__hosts
+        keys = self.__keys
+        values = self.__values
+        clocks = self.__clocks
+        for index in xrange(len(hosts)):
+            host = hosts[index]
+            if host is not None:
+                yield index, self.__createDataPoint(host, keys[index], values[index], clocks[index])
+
     
     def getData(self):
         '''
@@ -159,10 +446,7 @@ class pyZabbixSender:
         #####Return:
         A copy of the internal data you added using the method *addData* (an array of dicts).
         '''
-        copy_of_data = []
-        for data_point in self.__data:
-            copy_of_data.append(data_point.copy())    
-        return copy_of_data
+        return [data_point for index, data_point in self.iterData()]
         
         
     def printData(self):
@@ -174,9 +458,9 @@ class pyZabbixSender:
         #####Return:
         None
         '''
-        for elem in self.__data:
+        for index, elem in self.iterData():
             print str(elem)
-        print 'Count: %d' % len(self.__data)
+        print 'Count: %d' % self.__count
 
 
     def removeDataPoint(self, data_point):
@@ -189,11 +473,42 @@ class pyZabbixSender:
         #####Return:
         It returns True if data_point was found and deleted, and False if not.
         '''
-        if data_point in self.__data:
-            self.__data.remove(data_point)
+        for index, elem in self.iterData():
+            if elem == data_point:
+                return self.removeDataPointAt(index)
+
+        return False
+
+
+    def removeDataPointAt(self, index):
+        '''
+        #####Description:
+        This method deletes the data point at an index of the internal stored data, in constant time. Indexes of the other data points don't change until the data is sent, deleted data points are dropped then.
+        #####Parameters:
+        * **index**: [in] [integer] [mandatory] The index of the data point, as returned by *iterData*.
+        #####Return:
+        It returns True if the data point was found and deleted, and False if not.
+        '''
+        if 0 <= index < len(self.__hosts) and self.__hosts[index] is not None:
+            self.__hosts[index] = None
+            self.__values[index] = None
+            self.__count -= 1
             return True
-        
+
         return False
+
+
+    def __compact(self):
+        '''
+        Drops the data points deleted by *removeDataPointAt*, the indexes of the other data points change.
+        '''
+        if self.__count == len(self.__hosts):
+            return
+        indexes = [index for index, host in enumerate(self.__hosts) if host is not None]
+        self.__hosts = [self.__hosts[index] for index in indexes]
+        self.__keys = [self.__keys[index] for index in indexes]
+        self.__values = [self.__values[index] for index in indexes]
+        self.__clocks = array('l', (self.__clocks[index] for index in indexes))
         
         
     def sendData(self, packet_clock=None, max_data_per_conn=None):
@@ -210,34 +525,101 @@ class pyZabbixSender:
               
         * **max_data_per_conn**: [in] [integer] [optional] Allows the user to limit the number of data points sent in one single connection, as some times a too big number can produce problems over slow connections. 
             Several "sends" will be automatically performed until all data is sent.
-            If omitted, all data points will be sent in one single connection. *Default value: None*
+            If omitted, all data points will be sent in one single connection, unless they don't fit in *max_packet_size* bytes. *Default value: None*
          
         Please note that **internal data is not deleted after *sendData* is executed**. You need to call *clearData* after sending it, if you want to remove currently stored data.
         #####Return:
         A list of *(return_code, msg_from_server)* associated to each "send" operation.
         '''
-        if not max_data_per_conn or max_data_per_conn > len(self.__data):
-            max_data_per_conn = len(self.__data)
+        return self.__sendMany(self.getPackets(packet_clock, max_data_per_conn))
 
+
+    def __sendBatch(self, batch, packet_clock, retries, backoff):
+        '''
+        Sends a batch of data points, retrying the packets with connection errors and invalid responses with exponential backoff.
+        Packets answered by the server are not sent again.
+        Returns the responses of the last send of each packet, and the data points of the packets still not delivered.
+        '''
         responses = []
-        i = 0
-        while i*max_data_per_conn < len(self.__data):
+        pending = batch
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(backoff * 2 ** (attempt - 1))
+            counts = []
+            packet_responses = self.__sendMany(self.__buildPackets(pending, packet_clock, counts=counts))
+            failed = []
+            start = 0
+            for response, count in zip(packet_responses, counts):
+                if response[0] in (self.RC_ERR_CONN, self.RC_ERR_INV_RESP):
+                    failed.extend(pending[start:start + count])
+                    if attempt == retries:
+                        responses.append(response)
+                else:
+                    responses.append(response)
+                start += count
+            pending = failed
+            if not pending:
+                break
+        return responses, pending
+
 
-            sender_data = {
-                "request": "sender data",
-                "data": [],
-            }
-            if packet_clock:
-                sender_data['clock'] = packet_clock
+    def failedCount(self, responses):
+        '''
+        #####Description:
+        Counts the data points failed by the Zabbix server in the responses to a send.
+        #####Parameters:
+        * **responses**: [in] [list] [mandatory] A list of *(return_code, msg_from_server)* as returned by *sendData*.
+        #####Return:
+        The number of failed data points.
+        '''
+        failed = 0
+        for retcode, response in responses:
+            if retcode == self.RC_ERR_FAIL_SEND:
+                failed += int(re.match('^.*failed.+?(\d+).*$', response['info'].lower()).group(1))
+        return failed
 
-            sender_data['data'] = self.__data[i*max_data_per_conn:(i+1)*max_data_per_conn]
-            to_send = json.dumps(sender_data)
 
-            response = self.__send(to_send)
-            responses.append(response)
-            i += 1
+    def sendDataRetry(self, packet_clock=None, max_data_per_conn=None, retries=3, backoff=1):
+        '''
+        #####Description:
+        Sends data stored using *addData* method, like *sendData*, and isolates the data points failed by the Zabbix server.
+        A batch with failed data points is split in halves which are sent again, until the failed data points are found, so only a few sends are needed for a few failures in a big batch.
+        Connection errors are retried with exponential backoff.
+        Please note that data points accepted in a batch with failures are sent again while isolating the failed ones.
+        #####Parameters:
+        It shares the *packet_clock* and *max_data_per_conn* parameters of the *sendData* method.
+        * **retries**: [in] [integer] [optional] Number of times a batch is sent again after a connection error. *Default value: 3*
+        * **backoff**: [in] [integer] [optional] Seconds to wait before the first retry, doubled at each retry. *Default value: 1*
+        #####Return:
+        A list of *(return_code, msg_from_server)* of the last send of each batch, and the list of data points failed by the Zabbix server.
+        '''
+        self.__compact()
+        data = [data_point for index, data_point in self.iterData()]
+        size = max_data_per_conn or len(data) or 1
+        # Batches waiting to be sent, the next batch is at the end
+        batches = [data[i:i + size] for i in range(0, len(data), size)]
+        batches.reverse()
 
-        return responses
+        results = []
+        rejected = []
+        self.__packet_counts = []
+        self.__undelivered = []
+        while batches:
+            batch = batches.pop()
+            responses, undelivered = self.__sendBatch(batch, packet_clock, retries, backoff)
+            self.__undelivered.extend(undelivered)
+            failed = self.failedCount(responses)
+            if not failed or [r for r in responses if r[0] in (self.RC_ERR_CONN, self.RC_ERR_INV_RESP)]:
+                results.extend(responses)
+            elif failed >= len(batch):
+                # Every data point of the batch failed
+                results.extend(responses)
+                rejected.extend(batch)
+            else:
+                half = len(batch) // 2
+                batches.append(batch[half:])
+                batches.append(batch[:half])
+        return results, rejected
 
 
     def sendDataOneByOne(self):
@@ -254,7 +636,7 @@ class pyZabbixSender:
         It returns an array of return codes (one for each individual "send") and the data sent: \[\[code\_1, data\_point\_1], \[code\_2, data\_point\_2\]\]
         '''
         retarray = []
-        for i in self.__data:
+        for index, i in self.iterData():
             if 'clock' in i:
                 (retcode, retstring) = self.sendSingle(i['host'], i['key'], i['value'], i['clock'])
             else:
@@ -281,15 +663,8 @@ class pyZabbixSender:
         #####Return:
         A list containing the return code and the message returned by the server.
         '''
-        sender_data = {
-            "request": "sender data",
-            "data": [],
-        }
-
         obj = self.__createDataPoint(host, key, value, clock)
-        sender_data['data'].append(obj)
-        to_send = json.dumps(sender_data)
-        return self.__send(to_send)
+        return self.__send(next(self.__buildPackets([obj])))
 
 
         
@@ -303,6 +678,7 @@ class pyZabbixSender:
 # z = pyZabbixSender(server="172.0.0.100",verbose=True)
 # z = pyZabbixSender(server="zabbix-server",port=10051)
 # z = pyZabbixSender("zabbix-server", 10051)
+# z = pyZabbixSender("zabbix-server", 10051, persistent=True, pool_size=4) # Keeps up to 4 connections open between sends
 
 # --- Adding data to send later ---
 # Host, Key, Value are all necessary
@@ -358,6 +734,21 @@ class pyZabbixSender:
 #   if code != z.RC_OK:
 #      print "Failed to send: %s" % str(data)
 #
+# Sending everything and finding the data points failed by the server with
+# a few sends, instead of sending every item individually
+#
+# (results, rejected) = z.sendDataRetry(max_data_per_conn=200)
+# for data in rejected:
+#   print "Failed to send: %s" % str(data)
+#
+# Iterating over the data without copying it, and removing data points by index
+# for (index,data) in z.iterData():
+#   if data['key'] == "test_trap":
+#      z.removeDataPointAt(index)
+#
+# A persistent sender keeps its connections open, close them when done:
+# z.close()
+#
 #
 #####################################
 # Mini example of a working program #
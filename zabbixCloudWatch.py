@@ -5,38 +5,144 @@
 # Description: A script to bulk send cloudwatch metrics data by using python zabbix sender
 # Requires Python Zabbix Sender: https://github.com/kmomberg/pyZabbixSender/blob/master/pyZabbixSender.py
 # Example Usage: zabbixCloudWatch.py -z <zabbix_server> -x <zabbix_host> -a <aws_account> -r <aws_region> -s <aws_service> -d "<Dimension>" -p 300 -f "2015-08-13 04:00:00" -t "2015-08-13 04:15:00"
+# Collector Usage: zabbixCloudWatch.py -i conf/aws_inventory.conf -D
+# Incremental Usage: zabbixCloudWatch.py -z <zabbix_server> -x <zabbix_host> -a <aws_account> -r <aws_region> -s <aws_service> -d "<Dimension>" -p 300 -w /var/lib/zabbix/cloudwatch.watermark.db
+# Backfill Usage: zabbixCloudWatch.py -z <zabbix_server> -x <zabbix_host> -a <aws_account> -r <aws_region> -s <aws_service> -d "<Dimension>" -p 60 -f "2015-08-01 00:00:00" -t "2015-08-13 00:00:00" -F -c 4
+# Spool Usage: zabbixCloudWatch.py -i conf/aws_inventory.conf -D -w /var/lib/zabbix/cloudwatch.watermark.db -S /var/lib/zabbix/cloudwatch.spool
+# Sharded Usage: zabbixCloudWatch.py -i conf/aws_inventory.conf -D -N /var/lib/zabbix/cloudwatch.shards.db -W 4
+# Template Usage: zabbixCloudWatch.py -z <zabbix_server> -x <zabbix_host> -a <aws_account> -r <aws_region> -s ElastiCache -d "CacheClusterId=<cluster_id>" -e "Template AWS ElastiCache:redis" -p 300 -f "2015-08-13 04:00:00" -t "2015-08-13 04:15:00"
+# Multi-resource Usage: zabbixCloudWatch.py -z <zabbix_server> -x <zabbix_host> -a <aws_account> -r <aws_region> -s SQS -d "QueueName=<queue_1>" -d "QueueName=<queue_2>" -p 300 -f "2015-08-13 04:00:00" -t "2015-08-13 04:15:00"
 
 import os
-import re
 import sys
 import time
 import json
-import fileinput
-from dateutil import tz
-from datetime import datetime
+import Queue
+import calendar
+import signal
+import socket
+import traceback
+import threading
+from datetime import datetime, timedelta
 from optparse import OptionParser
 from operator import itemgetter
 from awsAccount import awsAccount
 from awsConnection import awsConnection
+from awsMetricData import awsMetricData
+from awsServicesConfig import awsServicesConfig
+from awsFetchPool import awsFetchPool
+from awsRateLimiter import awsRateLimiter
+from awsEMRClusterIndex import awsEMRClusterIndex
+from cloudWatchLog import cloudWatchLog
+from cloudWatchWatermark import cloudWatchWatermark
+from cloudWatchSpool import cloudWatchSpool
+from cloudWatchCache import cloudWatchCache
+from cloudWatchMetricIndex import cloudWatchMetricIndex
+from cloudWatchStats import cloudWatchStats
+from cloudWatchShards import cloudWatchShards
 from boto.exception import BotoServerError
 from pyZabbixSender import pyZabbixSender
+from zabbixTemplateIndex import zabbixTemplateIndex
+from zabbixMultiSender import zabbixMultiSender
 
 # aws services metrics configuration file
 base_path = os.path.dirname(os.path.realpath(__file__))
 aws_services_conf = base_path + '/conf/aws_services_metrics.conf'
+# zabbix templates, only metrics with a trapper item in the templates are fetched
+zabbix_templates_dir = base_path + '/templates'
+template_index = zabbixTemplateIndex(zabbix_templates_dir)
+# Metric plans compiled from the aws services metrics configuration, reloaded when the file is modified
+aws_services_config = awsServicesConfig(aws_services_conf, template_index)
+# resource inventory used by the collector mode
+aws_inventory_conf = base_path + '/conf/aws_inventory.conf'
+
+# Default collection period in seconds, same as the cron scripts
+default_period = 300
+# Minutes of lag behind current time before collecting cloudwatch data,
+# CloudWatch doesn't send all data if requested too early (see cron.d scripts)
+default_lag = 5
+service_lag = {'DynamoDB': 15, 'ElasticMapReduce': 0, 'VPN': 0}
+# Fetch metrics with batched GetMetricData requests instead of one get_metric_statistics call per metric
+fetch_batch = False
+# Max number of concurrent cloudwatch requests
+fetch_concurrency = 1
+fetch_pool = None
+# Max cloudwatch requests per second in an account and region, defaults to the cloudwatch api quota
+fetch_rate = None
+api_rate = {'GetMetricStatistics': 400, 'GetMetricData': 50, 'ListMetrics': 25}
+# Watermark store of the last delivered datapoint of each zabbix key, for incremental fetch windows
+watermarks = None
+# Max seconds of data fetched after the watermark of a key
+max_backfill = 10800
+# Max number of datapoints returned by a get_metric_statistics call, backfill chunks are sized by it
+max_datapoints = 1440
+# Datapoints sent to zabbix in one batch, and max number of fetched chunks waiting to be sent in backfill mode
+backfill_batch = 1000
+backfill_queue_size = 4
+# Short-lived cache of cloudwatch responses, shared by hosts monitoring the same resource
+response_cache = cloudWatchCache()
+# Metrics listed by cloudwatch for each resource, queries of metrics not listed are not fetched
+# None to fetch every query of the metric plans
+metric_index = None
+# JobFlowId of running EMR clusters by name, listed once per account and region and shared by all processes
+emr_clusters = awsEMRClusterIndex()
+# Trapper port of zabbix servers and proxies
+zabbix_port = 10051
+# Timings and counters of a collector cycle, sent as trapper items of the monitor host if it is set
+# Timings and counters of a send are only known after it, they are sent with the next cycle
+collector_stats = cloudWatchStats()
+send_stats = cloudWatchStats()
+monitor_host = None
+monitor_server = None
+# Find the data points rejected by zabbix by sending batches with failures again in halves,
+# data points accepted in those batches are sent more than once
+isolate_rejected = False
+# Zabbix senders by zabbix server
+zabbix_senders = {}
+# Sender of the collector, which sends to all zabbix servers and proxies concurrently
+zabbix_multi_sender = None
+# Max time in seconds to send the data of one zabbix server in the collector
+send_timeout = 30
+# Spool of datapoints not delivered to zabbix, None if datapoints of failed sends are dropped
+spool = None
+# Datapoints sent to a zabbix server in one batch when draining the spool
+spool_batch = 1000
+# Shard of the inventory collected by this process, None to collect the whole inventory
+shards = None
 
 # Config command line options
 def config_parser():
     parser = OptionParser(usage="usage: %prog [options]", version="%prog 2.0")
     parser.add_option("-z", "--zabbix", dest="zabbixserver", help="zabbix server name", metavar="ZABBIX")
-    parser.add_option("-x", "--host", dest="zabbixhost", help="zabbix host name", metavar="HOST")
+    parser.add_option("-x", "--host", dest="zabbixhost", action="append", help="zabbix host name, repeat with -d to collect many resources", metavar="HOST")
     parser.add_option("-a", "--account", dest="accountname", help="account name", metavar="ACCOUNT")
     parser.add_option("-r", "--region", dest="region", help="aws region", metavar="REGION")
     parser.add_option("-s", "--service", dest="service", help="aws service (ELB, SQS, DynamoDB, etc...)", metavar="SERVICE")
-    parser.add_option("-d", "--dimensions", dest="dimensions", help="Dimensions split with comma (LoadBalancerName=, etc...)", metavar="DIMENSIONS")
+    parser.add_option("-d", "--dimensions", dest="dimensions", action="append", help="Dimensions split with comma (LoadBalancerName=, etc...), repeat to collect many resources", metavar="DIMENSIONS")
     parser.add_option("-p", "--period", dest="period", help="Period", metavar="PERIOD")
     parser.add_option("-f", "--starttime", dest="starttime", help="Start Time", metavar="STARTTIME")
     parser.add_option("-t", "--endtime", dest="endtime", help="End Time", metavar="ENDTIME")
+    parser.add_option("-i", "--inventory", dest="inventory", help="Collect all resources in an inventory file", metavar="INVENTORY")
+    parser.add_option("-b", "--batch", dest="batch", action="store_true", default=False, help="Fetch metrics in batches with GetMetricData")
+    parser.add_option("-c", "--concurrency", dest="concurrency", default=1, help="Max number of concurrent cloudwatch requests", metavar="CONCURRENCY")
+    parser.add_option("-R", "--rate", dest="rate", help="Max cloudwatch requests per second in an account and region", metavar="RATE")
+    parser.add_option("-w", "--watermark", dest="watermark", help="Fetch only data newer than the last delivered datapoint of each key, kept in a watermark file", metavar="WATERMARK")
+    parser.add_option("-m", "--max-backfill", dest="maxbackfill", help="Max seconds of data fetched after the last delivered datapoint", metavar="MAXBACKFILL")
+    parser.add_option("-F", "--backfill", dest="backfill", action="store_true", default=False, help="Send all cloudwatch data between start time and end time in chunks")
+    parser.add_option("-T", "--send-timeout", dest="sendtimeout", help="max time in seconds to send data to a zabbix server in the collector, default 30", metavar="SEND_TIMEOUT")
+    parser.add_option("--isolate-rejected", dest="isolaterejected", action="store_true", default=False, help="Report the data points rejected by zabbix, batches with failures are sent again in halves")
+    parser.add_option("-S", "--spool", dest="spool", help="spool directory, datapoints not delivered to zabbix are kept there and sent again", metavar="SPOOL_DIR")
+    parser.add_option("-C", "--cache-dir", dest="cachedir", help="directory of cached cloudwatch responses, shared by processes running in the same cycle", metavar="CACHE_DIR")
+    parser.add_option("--cache-ttl", dest="cachettl", help="time to live of cached cloudwatch responses in seconds, default 60", metavar="CACHE_TTL")
+    parser.add_option("-L", "--list-ttl", dest="listttl", help="list the metrics of each resource and skip the metrics it doesn't have, time to live of the listings in seconds", metavar="LIST_TTL")
+    parser.add_option("--emr-ttl", dest="emrttl", help="time to live of the listing of EMR clusters in seconds, default 900, 0 to list clusters on every run", metavar="EMR_TTL")
+    parser.add_option("-e", "--template", dest="template", help="zabbix template linked to the zabbix hosts, only metrics with a trapper item in that template are fetched, default all templates of the service", metavar="TEMPLATE")
+    parser.add_option("--all-metrics", dest="allmetrics", action="store_true", default=False, help="Fetch all configured metrics, also those without a trapper item in the zabbix templates")
+    parser.add_option("-M", "--monitor-host", dest="monitorhost", help="zabbix host of the collector, timings and counters of each collector cycle are sent as its trapper items", metavar="MONITOR_HOST")
+    parser.add_option("-N", "--shard-file", dest="shardfile", help="lease file shared by collector processes and nodes, each collects its own shard of the inventory, and their watermark file with -w", metavar="SHARD_FILE")
+    parser.add_option("-W", "--workers", dest="workers", help="number of collector processes sharing the inventory, needs a shard file", metavar="WORKERS")
+    parser.add_option("--node", dest="node", help="name of this node in the shard file, default the host name", metavar="NODE")
+    parser.add_option("-D", "--daemon", dest="daemon", action="store_true", default=False, help="Keep running and collect the inventory every period")
     return parser
 
 # Covert dimensions string to json format
@@ -50,151 +156,222 @@ def dimConvert(d):
         dim[secondSplit[0]] = secondSplit[1]
     return dim
 
-# Convert timestamp from UTC to local time
-def utcToLocaltimestamp(timestamp):
-    from_zone = tz.tzutc()
-    to_zone = tz.tzlocal()
-    utctimestamp = timestamp.replace(tzinfo=from_zone)
-    return utctimestamp.astimezone(to_zone)
+# Convert a UTC timestamp to unix epoch seconds, the zabbix item timestamp
+# Cloudwatch timestamps are naive UTC datetimes, they don't go through the local timezone
+def utcToEpoch(timestamp):
+    return calendar.timegm(timestamp.timetuple())
 
-# Get DynamoDB cloudwatch data
-def getCloudWatchDynamodbData(a, r, s, t, i=None):
+# Convert UTC timestamps of many datapoints to unix epoch seconds at once
+def utcToEpochs(timestamps):
+    timegm = calendar.timegm
+    return [timegm(timestamp.timetuple()) for timestamp in timestamps]
+
+# Get DynamoDB cloudwatch metric queries of a table
+def getDynamodbMetricQueries(a, r, s, t, i=None):
     account = a
-    aws_account = awsAccount(account)
-    aws_access_key_id = aws_account._aws_access_key_id
-    aws_secret_access_key = aws_account._aws_secret_access_key
     aws_region = r
     aws_service = s
     table_name = t
     global_index = i
 
-    namespace = 'AWS/' + aws_service
-    operations_all = ['GetItem', 'PutItem', 'Query', 'Scan', 'UpdateItem', 'DeleteItem', 'BatchGetItem', 'BatchWriteItem']
-    operations_returned_item = ['Query', 'Scan']
-
-    global period
-    global start_time
-    global end_time
-    # get_metric_statistics(period, start_time, end_time, metric_name, namespace, statistics, dimensions=None, unit=None)
-    try:
-        conn = awsConnection()
-        conn.cloudwatchConnect(aws_region, aws_access_key_id, aws_secret_access_key)
-        cw = conn._aws_connection
+    dimensions = {'TableName': table_name}
+    if global_index:
+        dimensions['GlobalSecondaryIndexName'] = global_index
+    # Format the compiled DynamoDB metric plan
+    queries = aws_services_config.getQueries(account, aws_region, aws_service, dimensions)
+    # Metrics of all operations and indexes of the table are listed together
+    return planMetricQueries(account, aws_region, aws_service, {'TableName': table_name}, queries)
 
-        # Read DynamoDB metrics
-        aws_metrics = json.loads(open(aws_services_conf).read())
+# Get cloudwatch metric queries of an AWS service, only metrics of the zabbix template if it is given
+def getMetricQueries(a, r, s, d, t=None):
+    account = a
+    aws_region = r
+    aws_service = s
+    dimensions = d
+    template = t
 
-        # Initialize cloud watch data list for storing results
-        cloud_watch_data = []
+    # Format the compiled metric plan of the service
+    queries = aws_services_config.getQueries(account, aws_region, aws_service, dimensions, template)
+    return planMetricQueries(account, aws_region, aws_service, dimensions, queries)
 
-        for metric in aws_metrics[aws_service]:
-            metric_name = metric['metric']
-            statistics = metric['statistics']
-            dimensions = {}
-
-            if metric_name in ('SuccessfulRequestLatency', 'SystemErrors', 'ThrottledRequests'):
-                for op in operations_all:
-                    dimensions['TableName'] = table_name
-                    dimensions['Operation'] = op
-                    # Get cloudwatch data
-                    results = cw.get_metric_statistics(period, start_time, end_time, metric_name, namespace, statistics, dimensions)
-                    metric_results = {}
-                    # Generate a zabbix trapper key for a metric
-                    zabbix_key = 'DynamoDB.' + op + '.' + metric_name + '.' + statistics + '["' + account + '","' + aws_region + '","' + table_name + '"]'
-                    metric_results['zabbix_key'] = zabbix_key
-                    metric_results['cloud_watch_results'] = results
-                    metric_results['statistics'] = statistics
-                    cloud_watch_data.append(metric_results)
-            elif metric_name == 'ReturnedItemCount':
-                for op in operations_returned_item:
-                    dimensions['TableName'] = table_name
-                    dimensions['Operation'] = op
-                    # Get cloudwatch data
-                    results = cw.get_metric_statistics(period, start_time, end_time, metric_name, namespace, statistics, dimensions)
-                    metric_results = {}
-                    # Generate a zabbix trapper key for a metric
-                    zabbix_key = 'DynamoDB.' + op + '.' + metric_name + '.' + statistics + '["' + account + '","' + aws_region + '","' + table_name + '"]'
-                    metric_results['zabbix_key'] = zabbix_key
-                    metric_results['cloud_watch_results'] = results
-                    metric_results['statistics'] = statistics
-                    cloud_watch_data.append(metric_results)
-            elif metric_name in ('OnlineIndexConsumedWriteCapacity', 'OnlineIndexPercentageProgress', 'OnlineIndexThrottleEvents'):
-                if global_index:
-                    dimensions['TableName'] = table_name
-                    dimensions['GlobalSecondaryIndexName'] = global_index
-                    # Get cloudwatch data
-                    results = cw.get_metric_statistics(period, start_time, end_time, metric_name, namespace, statistics, dimensions)
-                    metric_results = {}
-                    # Generate a zabbix trapper key for a metric
-                    zabbix_key = 'DynamoDB.' +  metric_name + '.' + statistics + '["' + account + '","' + aws_region + '","' + table_name + '","' + global_index + '"]'
-                    metric_results['zabbix_key'] = zabbix_key
-                    metric_results['cloud_watch_results'] = results
-                    metric_results['statistics'] = statistics
-                    cloud_watch_data.append(metric_results)
-            else:
-                dimensions['TableName'] = table_name
-                # Get cloudwatch data
-                results = cw.get_metric_statistics(period, start_time, end_time, metric_name, namespace, statistics, dimensions)
-                metric_results = {}
-                # Generate a zabbix trapper key for a metric
-                zabbix_key = 'DynamoDB.' +  metric_name + '.' + statistics + '["' + account + '","' + aws_region + '","' + table_name + '"]'
-                metric_results['zabbix_key'] = zabbix_key
-                metric_results['cloud_watch_results'] = results
-                metric_results['statistics'] = statistics
-                cloud_watch_data.append(metric_results)
+# List the metrics cloudwatch has for a resource, metrics having all the given dimensions
+# Returns a set of (metric name, frozenset of dimensions), or None if they can't be listed
+def listResourceMetrics(a, r, n, d):
+    account = a
+    aws_account = awsAccount(account)
+    aws_access_key_id = aws_account._aws_access_key_id
+    aws_secret_access_key = aws_account._aws_secret_access_key
+    aws_region = r
+    namespace = n
+    dimensions = d
 
-        return cloud_watch_data
+    conn = awsConnection()
+    conn.cloudwatchConnect(aws_region, aws_access_key_id, aws_secret_access_key)
+    cw = conn._aws_connection
+    limiter = awsRateLimiter.getLimiter((account, aws_region, 'ListMetrics'), api_rate['ListMetrics'])
 
+    metrics = set()
+    next_token = None
+    try:
+        while True:
+            # list_metrics(next_token=None, dimensions=None, metric_name=None, namespace=None)
+            results = limiter.call(cw.list_metrics, next_token, dimensions, None, namespace)
+            for metric in results:
+                metrics.add((metric.name, frozenset((name, values[0]) for name, values in metric.dimensions.items())))
+            next_token = results.next_token
+            if not next_token:
+                break
     except BotoServerError, error:
-        print >> sys.stderr, 'CloudWatch ERROR: ', error
+        print >> sys.stderr, 'CloudWatch ERROR: ListMetrics', error
+        return None
+    return metrics
 
-# Get cloudwatch metrics data of an AWS service
-def getCloudWatchData(a, r, s, d):
+# Mark the metric queries of a resource whose metric is not listed by cloudwatch as absent, with the time of the listing
+# Absent queries are not fetched in time windows ending before the listing by at least the listing delay of cloudwatch,
+# they are sent as zero like queries without data
+def planMetricQueries(a, r, s, d, q):
     account = a
-    aws_account = awsAccount(account)
-    aws_access_key_id = aws_account._aws_access_key_id
-    aws_secret_access_key = aws_account._aws_secret_access_key
     aws_region = r
     aws_service = s
     dimensions = d
+    queries = q
 
+    if metric_index is None or not dimensions:
+        return queries
     namespace = 'AWS/' + aws_service
+    key = metric_index.key(account, aws_region, namespace, dimensions)
+    listed_at, metrics = metric_index.get(key)
+    if listed_at is None:
+        metrics = listResourceMetrics(account, aws_region, namespace, dimensions)
+        listed_at = metric_index.put(key, metrics)
+    # Fetch every query if the metrics can't be listed
+    if metrics is not None:
+        for query in queries:
+            query['absent'] = not metric_index.exists(metrics, query)
+            query['listed_at'] = listed_at
+    return queries
+
+# Get the shared pool of worker threads for fetching cloudwatch data
+def getFetchPool():
+    global fetch_pool
+    if fetch_pool is None:
+        fetch_pool = awsFetchPool(fetch_concurrency)
+    return fetch_pool
+
+# Fetch cloudwatch data of metric queries in an account and region
+# Queries are sent in GetMetricData batches if batch fetching is enabled,
+# otherwise with one get_metric_statistics call per query.
+# Calls run concurrently in the fetch pool, within the rate limit of the account and region.
+# Responses are cached for a short time, and identical queries are fetched once.
+# The time window is the global period, start time and end time, unless a (period, start time, end time) window is given,
+# responses of a given window (backfill chunks) are not cached, they are never fetched twice
+# Results of queries whose call failed are None, so only the resources of those queries are skipped
+def fetchCloudWatchData(a, r, q, w=None):
+    account = a
+    aws_account = awsAccount(account)
+    aws_access_key_id = aws_account._aws_access_key_id
+    aws_secret_access_key = aws_account._aws_secret_access_key
+    aws_region = r
+    queries = q
+
     global period
     global start_time
     global end_time
-    # get_metric_statistics(period, start_time, end_time, metric_name, namespace, statistics, dimensions=None, unit=None)
-    try:
+
+    fetch_period, fetch_start_time, fetch_end_time = w or (period, start_time, end_time)
+    cached = w is None
+
+    # Connections are cached by awsConnection, every worker thread reuses its own connection
+    def getConnection():
+        started = time.time()
         conn = awsConnection()
         conn.cloudwatchConnect(aws_region, aws_access_key_id, aws_secret_access_key)
-        cw = conn._aws_connection
+        collector_stats.addTiming('connect', time.time() - started)
+        return conn._aws_connection
 
-        # Read AWS services metrics
-        aws_metrics = json.loads(open(aws_services_conf).read())
+    # Count and time every attempt of an api call, throttled attempts are retried by the rate limiter
+    def monitored(api, func):
+        def call(*args):
+            collector_stats.count('api_calls')
+            started = time.time()
+            try:
+                return func(*args)
+            except BotoServerError, error:
+                if error.error_code in awsRateLimiter.THROTTLE_ERRORS:
+                    collector_stats.count('throttles')
+                raise
+            finally:
+                collector_stats.addTiming(api, time.time() - started)
+        return call
 
-        # Initialize cloud watch data list for storing results
-        cloud_watch_data = []
+    # get_metric_statistics(period, start_time, end_time, metric_name, namespace, statistics, dimensions=None, unit=None)
+    # A failed call returns None, e.g. an invalid dimension of one resource must not fail the other resources
+    def getMetricStatistics(query):
+        try:
+            cw = getConnection()
+            return limiter.call(monitored('get_metric_statistics', cw.get_metric_statistics), fetch_period, fetch_start_time, fetch_end_time, query['metric'], query['namespace'], query['statistics'], query['dimensions'])
+        except Exception, error:
+            collector_stats.count('fetch_errors')
+            print >> sys.stderr, 'CloudWatch ERROR: %s %s %s: %s' % (query['namespace'], query['metric'], query['dimensions'], error)
+            return None
+
+    # A failed request returns None for every query of the batch
+    def getMetricData(batch):
+        try:
+            cw = getConnection()
+            return limiter.call(monitored('GetMetricData', awsMetricData(cw).getMetricData), fetch_period, fetch_start_time, fetch_end_time, batch)
+        except Exception, error:
+            collector_stats.count('fetch_errors')
+            print >> sys.stderr, 'CloudWatch ERROR: GetMetricData of %d queries: %s' % (len(batch), error)
+            return [None] * len(batch)
+
+    try:
+        pool = getFetchPool()
+
+        # Get cached responses, and the distinct queries missing from the cache
+        keys = [response_cache.key(account, aws_region, query, fetch_period, fetch_start_time, fetch_end_time) for query in queries]
+        responses = {}
+        fetch_keys = []
+        fetch_queries = []
+        for key, query in zip(keys, queries):
+            if key in responses:
+                continue
+            # A metric not listed by cloudwatch has no data, unless it got data too recently to be listed
+            if query.get('absent') and query['listed_at'] - cloudWatchMetricIndex.LIST_DELAY >= utcToEpoch(fetch_end_time):
+                responses[key] = []
+                continue
+            responses[key] = response_cache.get(key) if cached else None
+            if responses[key] is None:
+                fetch_keys.append(key)
+                fetch_queries.append(query)
 
-        for metric in aws_metrics[aws_service]:
-            metric_name = metric['metric']
-            statistics = metric['statistics']
+        if fetch_batch:
+            limiter = awsRateLimiter.getLimiter((account, aws_region, 'GetMetricData'), fetch_rate or api_rate['GetMetricData'])
+            # Split queries into GetMetricData requests
+            batches = [fetch_queries[i:i + awsMetricData.MAX_QUERIES] for i in range(0, len(fetch_queries), awsMetricData.MAX_QUERIES)]
+            fetch_results = []
+            for batch_results in pool.map(getMetricData, batches):
+                fetch_results.extend(batch_results)
+        else:
+            limiter = awsRateLimiter.getLimiter((account, aws_region, 'GetMetricStatistics'), fetch_rate or api_rate['GetMetricStatistics'])
             # Get cloudwatch data
-            results = cw.get_metric_statistics(period, start_time, end_time, metric_name, namespace, statistics, dimensions)
+            fetch_results = pool.map(getMetricStatistics, fetch_queries)
 
-            metric_results = {}
+        for key, results in zip(fetch_keys, fetch_results):
+            responses[key] = results
+            if results is not None and cached:
+                response_cache.put(key, results)
+        cloud_watch_results = [responses[key] for key in keys]
+        collector_stats.count('empty_results', len([results for results in cloud_watch_results if results == []]))
+
+        # Initialize cloud watch data list for storing results
+        cloud_watch_data = []
 
-            # Generate a zabbix trapper key for a metric
-            if aws_service == 'SQS':
-                queue_name = dimensions['QueueName']
-                zabbix_key =  aws_service + '.' + metric_name + '.' + statistics + '["' + account + '","' + aws_region + '","' + queue_name + '"]'
-            elif aws_service == 'SNS':
-                topic_name = dimensions['TopicName']
-                zabbix_key =  aws_service + '.' + metric_name + '.' + statistics + '["' + account + '","' + aws_region + '","' + topic_name + '"]'
-            else:
-                zabbix_key =  aws_service + '.' + metric_name + '.' + statistics
-
-            metric_results['zabbix_key'] = zabbix_key
+        for query, results in zip(queries, cloud_watch_results):
+            metric_results = {}
+            metric_results['zabbix_key'] = query['zabbix_key']
             metric_results['cloud_watch_results'] = results
-            metric_results['statistics'] = statistics
+            metric_results['statistics'] = query['statistics']
             cloud_watch_data.append(metric_results)
 
         return cloud_watch_data
@@ -202,15 +379,115 @@ def getCloudWatchData(a, r, s, d):
     except BotoServerError, error:
         print >> sys.stderr, 'CloudWatch ERROR: ', error
 
-# Send latest cloudwatch data to zabbix server
-def sendLatestCloudWatchData(z, h, d):
+# Get DynamoDB cloudwatch data
+def getCloudWatchDynamodbData(a, r, s, t, i=None):
+    queries = getDynamodbMetricQueries(a, r, s, t, i)
+    return completeCloudWatchData(fetchCloudWatchData(a, r, queries))
+
+# Get cloudwatch metrics data of an AWS service
+def getCloudWatchData(a, r, s, d):
+    queries = getMetricQueries(a, r, s, d)
+    return completeCloudWatchData(fetchCloudWatchData(a, r, queries))
+
+# Check if cloudwatch data has a query whose fetch failed
+def fetchFailed(d):
+    cloud_watch_data = d
+    return bool([cwdata for cwdata in cloud_watch_data if cwdata['cloud_watch_results'] is None])
+
+# Check if no query of a resource got data
+def emptyCloudWatchData(d):
+    cloud_watch_data = d
+    return not [cwdata for cwdata in cloud_watch_data if cwdata['cloud_watch_results']]
+
+# Get cloudwatch data of a single resource, None if it couldn't be fetched completely
+def completeCloudWatchData(d):
+    cloud_watch_data = d
+    if cloud_watch_data is None or fetchFailed(cloud_watch_data):
+        return None
+    return cloud_watch_data
+
+# Get the zabbix sender of a zabbix server, senders are reused so their packet buffers are too
+# Connections are not kept open, a zabbix server closes the connection after each response
+def getZabbixSender(z):
+    zabbix_server = z
+    if zabbix_server not in zabbix_senders:
+        zabbix_senders[zabbix_server] = pyZabbixSender(server=zabbix_server, port=zabbix_port)
+    return zabbix_senders[zabbix_server]
+
+# Get the sender of the collector, which reuses the connections a zabbix proxy or server keeps open
+def getZabbixMultiSender():
+    global zabbix_multi_sender
+    if zabbix_multi_sender is None:
+        zabbix_multi_sender = zabbixMultiSender(port=zabbix_port, timeout=send_timeout)
+    return zabbix_multi_sender
+
+# Check if send results have a failure to talk to the zabbix server
+def sendFailed(r):
+    send_results = r
+    return bool([x for x in send_results if x[0] in (pyZabbixSender.RC_ERR_CONN, pyZabbixSender.RC_ERR_INV_RESP)])
+
+# Keep the data of a zabbix sender that didn't reach the zabbix server in the spool, only the packets that failed
+# Returns True if the data was spooled, spooled data is sent again by drainSpool so it doesn't need to be fetched again
+def spoolCloudWatchData(z, zs, r):
     zabbix_server = z
+    zabbix_sender = zs
+    send_results = r
+
+    if spool is None or not sendFailed(send_results):
+        return False
+    spool.append(zabbix_server, zabbix_sender.undeliveredData(send_results))
+    return True
+
+# Send datapoints kept in the spool to zabbix servers, oldest first
+# Zabbix servers are drained concurrently one batch at a time, a server is drained until a batch fails
+# A zabbix server being drained by another process is skipped
+def drainSpool(s):
+    zabbix_servers = s
+
+    pending = [zabbix_server for zabbix_server in spool.servers() if zabbix_server in zabbix_servers and spool.acquire(zabbix_server)]
+    acquired = list(pending)
+    multi_sender = getZabbixMultiSender()
+    try:
+        while pending:
+            multi_sender.clearData()
+            positions = {}
+            for zabbix_server in pending:
+                data_points, positions[zabbix_server] = spool.peek(zabbix_server, spool_batch)
+                for data_point in data_points:
+                    multi_sender.addData(zabbix_server, data_point['host'], data_point['key'], data_point['value'], data_point['clock'])
+            send_results = multi_sender.sendData()
+            drained = []
+            for zabbix_server in pending:
+                if sendFailed(send_results.get(zabbix_server, [])):
+                    print >> sys.stderr, 'Spool ERROR: zabbix server %s is not reachable, spooled datapoints are kept' % zabbix_server
+                    continue
+                spool.ack(zabbix_server, positions[zabbix_server])
+                if spool.peek(zabbix_server, 1)[0]:
+                    drained.append(zabbix_server)
+            pending = drained
+    finally:
+        multi_sender.clearData()
+        for zabbix_server in acquired:
+            spool.release(zabbix_server)
+
+# Close the fetch pool and zabbix connections before exit
+def closeConnections():
+    getFetchPool().close()
+    for zabbix_sender in zabbix_senders.values():
+        zabbix_sender.close()
+    if zabbix_multi_sender is not None:
+        zabbix_multi_sender.close()
+    if spool is not None:
+        spool.close()
+
+# Add latest cloudwatch data of a zabbix host to a zabbix sender
+def addLatestCloudWatchData(zs, h, d):
+    zabbix_sender = zs
     zabbix_host = h
     cloud_watch_data = d
 
     global start_time
 
-    zabbix_sender = pyZabbixSender(server=zabbix_server, port=10051)
     for cwdata in cloud_watch_data:
         zabbix_key = cwdata['zabbix_key']
         results = cwdata['cloud_watch_results']
@@ -221,24 +498,53 @@ def sendLatestCloudWatchData(z, h, d):
             sorts = sorted(results, key=itemgetter('Timestamp'), reverse=True)
             # Get the latest data and timestamp
             zabbix_key_value = sorts[0][statistics]
-            zabbix_key_timestamp = int(time.mktime(utcToLocaltimestamp(sorts[0]['Timestamp']).timetuple()))
+            zabbix_key_timestamp = utcToEpoch(sorts[0]['Timestamp'])
             # Add data to zabbix sender
             zabbix_sender.addData(zabbix_host, zabbix_key, zabbix_key_value, zabbix_key_timestamp)
         else:  # No data found within the time window
             # Set the zabbix key value to 0
             zabbix_key_value = 0
             # Set the zabbix key timestamp as the start time for getting cloudwatch data
-            zabbix_key_timestamp = int(time.mktime(utcToLocaltimestamp(start_time).timetuple()))
+            zabbix_key_timestamp = utcToEpoch(start_time)
             # Add data to zabbix sender
             zabbix_sender.addData(zabbix_host, zabbix_key, zabbix_key_value, zabbix_key_timestamp)
 
+# Report data points rejected by zabbix server, e.g. keys without a trapper item on the host
+def reportRejectedData(r):
+    rejected = r
+    for data_point in rejected:
+        print >> sys.stderr, 'Rejected by zabbix: %s on host %s' % (data_point['key'], data_point['host'])
+
+# Send the data of a zabbix sender, isolating and reporting the rejected data points if it is enabled
+def sendZabbixData(zs):
+    zabbix_sender = zs
+    if not isolate_rejected:
+        return zabbix_sender.sendData()
+    send_results, rejected = zabbix_sender.sendDataRetry()
+    reportRejectedData(rejected)
+    return send_results
+
+# Send latest cloudwatch data to zabbix server
+def sendLatestCloudWatchData(z, h, d):
+    zabbix_server = z
+    zabbix_host = h
+    cloud_watch_data = d
+
+    zabbix_sender = getZabbixSender(zabbix_server)
+    zabbix_sender.clearData()
+    addLatestCloudWatchData(zabbix_sender, zabbix_host, cloud_watch_data)
+
     # Send data to zabbix server
     #zabbix_sender.printData()
-    zabbix_sender.sendData()
+    send_results = sendZabbixData(zabbix_sender)
+    # Keep the data if it didn't reach the zabbix server, or send the spooled data now that it is reachable
+    if not spoolCloudWatchData(zabbix_server, zabbix_sender, send_results) and spool is not None:
+        drainSpool([zabbix_server])
+    return send_results
 
 # Send all cloudwatch data to zabbix server
 # init log file first by using this function "initCloudWatchLog"
-# then purge old lines with this function "purgeOldCloudWatchLog"
+# then purge old datapoints with this function "purgeOldCloudWatchLog"
 # this function is good to be used for sending 1-min cloudwatch data every 5 minutes
 def sendAllCloudWatchData(z, h, d, l):
     zabbix_server = z
@@ -248,10 +554,11 @@ def sendAllCloudWatchData(z, h, d, l):
 
     global start_time
 
-    # Open cloudwatch log file for appending
-    file = open(cw_log, 'a')
+    # Open cloudwatch log of sent datapoints
+    sent_log = cloudWatchLog(cw_log)
 
-    zabbix_sender = pyZabbixSender(server=zabbix_server, port=10051)
+    zabbix_sender = getZabbixSender(zabbix_server)
+    zabbix_sender.clearData()
     for cwdata in cloud_watch_data:
         zabbix_key = cwdata['zabbix_key']
         results = cwdata['cloud_watch_results']
@@ -260,84 +567,546 @@ def sendAllCloudWatchData(z, h, d, l):
         if results:
             # sort results by timestamp in descending order
             sorts = sorted(results, key=itemgetter('Timestamp'), reverse=True)
-            for sort in sorts:
+            for sort, zabbix_key_timestamp in zip(sorts, utcToEpochs([sort['Timestamp'] for sort in sorts])):
                 zabbix_key_value = sort[statistics]
-                zabbix_key_timestamp = int(time.mktime(utcToLocaltimestamp(sorts[0]['Timestamp']).timetuple()))
-                # Get cloudwatch data in the format of: <timestamp>,<key>,<value>
-                cw_data = str(zabbix_key_timestamp) + ',' + str(zabbix_key) + ',' + str(zabbix_key_value)
-                # Search cloudwatch log with timestamp and key, send cloudwatch data if it is not found in the log
-                cw_data_search = str(zabbix_key_timestamp) + ',' + str(zabbix_key)
-                # Add escape to square brackets for regular expression search, to fix search pattern error
-                cw_data_search = cw_data_search.replace("[", "\[").replace("]", "\]")
-                cw_data_found = 0
-                for line in open(cw_log, 'r'):
-                    if re.search(cw_data_search, line):
-                        cw_data_found = cw_data_found + 1
-                        break
-                # If data not found in the cloudwatch log, then add new data
-                if cw_data_found == 0:
+                # Send cloudwatch data if the timestamp and key are not found in the log
+                if not sent_log.isSent(zabbix_key, zabbix_key_timestamp):
                     # Add data to zabbix sender
                     zabbix_sender.addData(zabbix_host, zabbix_key, zabbix_key_value, zabbix_key_timestamp)
-                    # Write cloudwatch data to the log file
-                    file.write(cw_data + '\n')
+                    sent_log.markSent(zabbix_key, zabbix_key_timestamp, zabbix_key_value)
 
         else:  # No data found within the time window
             # Set the zabbix key value to 0
             zabbix_key_value = 0
             # Set the zabbix key timestamp as the start time for getting cloudwatch data
-            zabbix_key_timestamp = int(time.mktime(utcToLocaltimestamp(start_time).timetuple()))
-            # Get cloudwatch data in the format of: <timestamp>,<key>,<value>
-            cw_data = str(zabbix_key_timestamp) + ',' + str(zabbix_key) + ',' + str(zabbix_key_value)
-            # Search cloudwatch log with timestamp and key, send cloudwatch data if it is not found in the log
-            cw_data_search = str(zabbix_key_timestamp) + ',' + str(zabbix_key)
-            # Add escape to square brackets for regular expression search, to fix search pattern error
-            cw_data_search = cw_data_search.replace("[", "\[").replace("]", "\]")
-            cw_data_found = 0
-            for line in open(cw_log, 'r'):
-                if re.search(cw_data_search, line):
-                    cw_data_found = cw_data_found + 1
-                    break
-            # If data not found in the cloudwatch log, then add new data
-            if cw_data_found == 0:
+            zabbix_key_timestamp = utcToEpoch(start_time)
+            # Send cloudwatch data if the timestamp and key are not found in the log
+            if not sent_log.isSent(zabbix_key, zabbix_key_timestamp):
                 # Set zabbix trapper key value to 0 if no data found in cloudwatch
                 zabbix_sender.addData(zabbix_host, zabbix_key, zabbix_key_value, zabbix_key_timestamp)
-                # Write cloudwatch data to the log file
-                file.write(cw_data + '\n')
+                sent_log.markSent(zabbix_key, zabbix_key_timestamp, zabbix_key_value)
 
     # Send data to zabbix server
     #zabbix_sender.printData()
-    send_results = zabbix_sender.sendData()
-    file.write(str(send_results) + '\n')
-    # Close cloudwatch log file
-    file.close()
+    send_results = sendZabbixData(zabbix_sender)
+    # Keep datapoints in the log only if they reached the zabbix server or the spool, so they are sent again next time otherwise
+    if not spoolCloudWatchData(zabbix_server, zabbix_sender, send_results):
+        if sendFailed(send_results):
+            sent_log.rollback()
+        elif spool is not None:
+            drainSpool([zabbix_server])
+    sent_log.close()
+    return send_results
 
 # Initialize cloudwatch log
 def initCloudWatchLog(s, h, r):
     aws_service = s
     zabbix_host = h
     aws_region = r
-    # Create a log file to save cloudwatch data
-    cw_log = '/var/log/cloudwatch.' + aws_service + '.' + zabbix_host + '.' + aws_region + '.log'
+    # Create a log file to save sent cloudwatch datapoints
+    cw_log = '/var/log/cloudwatch.' + aws_service + '.' + zabbix_host + '.' + aws_region + '.db'
     # Remove spaces from log file name
     cw_log = cw_log.replace(" ", "")
     return cw_log
 
-# Purge old cloudwatch log, use together with these functions: "initCloudWatchLog" and "sendAllCloudWatchDataToZabbixSender"
-def purgeOldCloudWatchLog(l, b):
+# Purge old cloudwatch log, use together with these functions: "initCloudWatchLog" and "sendAllCloudWatchData"
+def purgeOldCloudWatchLog(l, m):
     cw_log = l
-    # Set how many lines to keep in the log file
-    log_buffer = b
-    # Count number of lines in cloudwatch log file
-    number_of_lines = len(open(cw_log).readlines())
-    # Last line number
-    last_line = number_of_lines - log_buffer
-    # Delete lines and keep the buffer lines
-    if last_line > 0:
-        for line_number, line in enumerate(fileinput.input(cw_log, inplace=1)):
-            if line_number < last_line:
+    # Keep datapoints newer than max age in seconds
+    max_age = m
+    sent_log = cloudWatchLog(cw_log)
+    sent_log.purge(max_age)
+    sent_log.close()
+
+# Identify EMR JobFlowId by cluster name, from the listing of running clusters shared by all EMR resources
+def getEMRJobFlowId(a, r, n):
+    account = a
+    aws_region = r
+    cluster_name = n
+
+    return emr_clusters.get(account, aws_region, cluster_name)
+
+# Get cloudwatch metric queries of a resource, dispatching on the aws service
+def getResourceMetricQueries(a, r, s, d, t=None):
+    aws_account = a
+    aws_region = r
+    aws_service = s
+    dimensions = d
+    template = t
+
+    if aws_service == 'DynamoDB':
+        table_name = dimensions['TableName']
+        # Get metric queries of a DynamoDB table
+        return getDynamodbMetricQueries(aws_account, aws_region, aws_service, table_name)
+    elif aws_service == 'ElasticMapReduce':
+        # EMR clusters are configured by name, look up the JobFlowId of the cluster
+        job_flow_id = getEMRJobFlowId(aws_account, aws_region, dimensions['JobFlowId'])
+        if job_flow_id is None:
+            return None
+        dimensions = dict(dimensions)
+        dimensions['JobFlowId'] = job_flow_id
+    # Get metric queries of an AWS service
+    return getMetricQueries(aws_account, aws_region, aws_service, dimensions, template)
+
+# Get cloudwatch data of a resource, only the metrics of a zabbix template if it is given
+def getResourceCloudWatchData(a, r, s, d, t=None):
+    queries = getResourceMetricQueries(a, r, s, d, t)
+    if queries is None:
+        return None
+    cw_data = completeCloudWatchData(fetchCloudWatchData(a, r, queries))
+    # An EMR cluster without data may have been replaced by a cluster with the same name, fetch the new one
+    if s == 'ElasticMapReduce' and queries and cw_data is not None and emptyCloudWatchData(cw_data):
+        emr_clusters.noData(a, r, d['JobFlowId'])
+        queries_retry = getResourceMetricQueries(a, r, s, d, t)
+        if queries_retry is None:
+            return None
+        if queries_retry[0]['dimensions'] != queries[0]['dimensions']:
+            cw_data = completeCloudWatchData(fetchCloudWatchData(a, r, queries_retry))
+    return cw_data
+
+# Read the resource inventory, a json list of targets in the format of:
+# {"zabbix_server": "", "zabbix_host": "", "account": "", "region": "", "service": "", "dimensions": "<Dimension>"}
+# "period" (seconds) and "lag" (minutes) are optional for each target, and "send_timeout" (seconds) of its zabbix server
+def loadInventory(i, z=None):
+    inventory_file = i
+    zabbix_server = z
+
+    targets = json.loads(open(inventory_file).read())
+    for target in targets:
+        # Use the zabbix server from command line if a target doesn't have one
+        if 'zabbix_server' not in target:
+            target['zabbix_server'] = zabbix_server
+        target['dimensions'] = dimConvert(target['dimensions'])
+        target['period'] = int(target.get('period', default_period))
+        target['lag'] = int(target.get('lag', service_lag.get(target['service'], default_lag)))
+        if 'send_timeout' in target:
+            target['send_timeout'] = int(target['send_timeout'])
+    return targets
+
+# Get the cloudwatch time window of a target, a fixed window or the period before the lag
+# With a watermark store, the window starts after the oldest datapoint delivered for the target's zabbix keys,
+# capped at the max backfill
+def getTargetWindow(t, n, q=None):
+    target = t
+    now = n
+    queries = q or []
+    if 'start_time' in target:
+        return target['start_time'], target['end_time']
+    end_time = now - timedelta(minutes=target['lag'])
+    start_time = end_time - timedelta(seconds=target['period'])
+    if watermarks is not None and queries:
+        delivered = [watermarks.get(target['zabbix_host'], query['zabbix_key']) for query in queries]
+        # Keys never delivered use the default window
+        if None not in delivered:
+            start_time = min(delivered) + timedelta(seconds=target['period'])
+            start_time = max(start_time, end_time - timedelta(seconds=max_backfill))
+    return start_time, end_time
+
+# Add cloudwatch data of a zabbix host to a zabbix sender, only datapoints newer than the watermark of each key
+# Returns the watermark updates of the added data, to apply once the data is delivered
+def addNewCloudWatchData(zs, h, d):
+    zabbix_sender = zs
+    zabbix_host = h
+    cloud_watch_data = d
+
+    global period
+    global start_time
+    global end_time
+
+    updates = {}
+    for cwdata in cloud_watch_data:
+        zabbix_key = cwdata['zabbix_key']
+        results = cwdata['cloud_watch_results']
+        statistics = cwdata['statistics']
+        watermark = watermarks.get(zabbix_host, zabbix_key)
+
+        if results:
+            # sort results by timestamp in ascending order
+            sorts = sorted(results, key=itemgetter('Timestamp'))
+            for sort, zabbix_key_timestamp in zip(sorts, utcToEpochs([sort['Timestamp'] for sort in sorts])):
+                if watermark is not None and sort['Timestamp'] <= watermark:
+                    continue
+                zabbix_key_value = sort[statistics]
+                # Add data to zabbix sender
+                zabbix_sender.addData(zabbix_host, zabbix_key, zabbix_key_value, zabbix_key_timestamp)
+                updates[(zabbix_host, zabbix_key)] = sort['Timestamp']
+        elif watermark is None or start_time > watermark:  # No data found within the time window
+            # Set the zabbix key value to 0, with the start time for getting cloudwatch data as timestamp
+            zabbix_key_timestamp = utcToEpoch(start_time)
+            zabbix_sender.addData(zabbix_host, zabbix_key, 0, zabbix_key_timestamp)
+            # The whole window is delivered, the next window starts at its end
+            updates[(zabbix_host, zabbix_key)] = end_time - timedelta(seconds=int(period))
+    return updates
+
+# Add timings and counters of the collector cycle to a zabbix sender, as trapper items of the monitor host
+# Timings and counters of the last send are added too, then reset
+# Collectors sharing the inventory add their member name to the keys, and the members are sent for low level discovery
+def addCollectorStats(zs, n):
+    zabbix_sender = zs
+    now = n
+
+    clock = utcToEpoch(now)
+    member = shards.getMember() if shards is not None else None
+    items = collector_stats.summary(('api_calls', 'throttles', 'empty_results', 'fetch_errors', 'datapoints'), member)
+    items.update(send_stats.summary(('failed', 'send_errors'), member))
+    send_stats.reset()
+    if member is not None:
+        items['zabbixCloudWatch.members'] = json.dumps({'data': [{'{#MEMBER}': name} for name in shards.getMembers()]})
+    for zabbix_key, value in sorted(items.items()):
+        zabbix_sender.addData(monitor_host, zabbix_key, value, clock)
+
+# Collect cloudwatch data of every target in the inventory and send it to zabbix
+# Targets sharing an account, region and time window are fetched together,
+# so batch fetching can pack metrics of many resources into one request.
+# Data of all targets is sent to all zabbix servers at the same time, a slow zabbix server doesn't delay the others
+def collectInventory(t, n):
+    targets = t
+    now = n
+
+    global period
+    global start_time
+    global end_time
+
+    # Align the time window to the minute, the same way as the cron scripts
+    now = now.replace(second=0, microsecond=0)
+    collector_stats.reset()
+
+    # Get metric queries of all targets and group them by account, region and time window
+    groups = {}
+    for target in targets:
+        try:
+            target_queries = collector_stats.timed('config', getResourceMetricQueries, target['account'], target['region'], target['service'], target['dimensions'], target.get('template'))
+        except Exception, error:
+            print >> sys.stderr, 'Collector ERROR: %s %s on host %s: %s' % (target['service'], target['dimensions'], target['zabbix_host'], error)
+            continue
+        if target_queries is None:
+            print >> sys.stderr, 'No cloudwatch data collected for %s %s on host %s' % (target['service'], target['dimensions'], target['zabbix_host'])
+            continue
+        target_start_time, target_end_time = getTargetWindow(target, now, target_queries)
+        # Nothing new since the last delivery
+        if target_start_time >= target_end_time:
+            continue
+        group = (target['account'], target['region'], target['period'], target_start_time, target_end_time)
+        groups.setdefault(group, []).append((target, target_queries))
+
+    # Watermark updates by zabbix server
+    multi_sender = getZabbixMultiSender()
+    multi_sender.clearData()
+    updates = {}
+
+    for (aws_account, aws_region, period, start_time, end_time), group_targets in groups.items():
+        # Remember which queries belong to a target
+        queries = []
+        collected = []
+        for target, target_queries in group_targets:
+            collected.append((target, len(queries), len(queries) + len(target_queries)))
+            queries.extend(target_queries)
+
+        try:
+            cw_data = fetchCloudWatchData(aws_account, aws_region, queries)
+        except Exception, error:
+            print >> sys.stderr, 'Collector ERROR: %s %s: %s' % (aws_account, aws_region, error)
+            continue
+        if cw_data is None:
+            continue
+
+        for target, first, last in collected:
+            # Targets with a failed query are skipped, their next window starts from the same watermarks
+            if fetchFailed(cw_data[first:last]):
+                print >> sys.stderr, 'No cloudwatch data collected for %s %s on host %s' % (target['service'], target['dimensions'], target['zabbix_host'])
                 continue
-            else:
-                sys.stdout.write(line)
+            # An EMR cluster without data may have been replaced by a cluster with the same name, look it up again next cycle
+            if target['service'] == 'ElasticMapReduce' and emptyCloudWatchData(cw_data[first:last]):
+                emr_clusters.noData(target['account'], target['region'], target['dimensions']['JobFlowId'])
+            zabbix_server = target['zabbix_server']
+            zabbix_sender = multi_sender.getSender(zabbix_server)
+            if 'send_timeout' in target:
+                multi_sender.setTimeout(zabbix_server, target['send_timeout'])
+            updates.setdefault(zabbix_server, {})
+            try:
+                if watermarks is not None:
+                    updates[zabbix_server].update(collector_stats.timed('convert', addNewCloudWatchData, zabbix_sender, target['zabbix_host'], cw_data[first:last]))
+                else:
+                    collector_stats.timed('convert', addLatestCloudWatchData, zabbix_sender, target['zabbix_host'], cw_data[first:last])
+            except Exception, error:
+                # A broken target must not stop the collection of the other targets
+                print >> sys.stderr, 'Collector ERROR: %s %s on host %s: %s' % (target['service'], target['dimensions'], target['zabbix_host'], error)
+
+    # Add timings and counters of the collector to the data of its zabbix server
+    if monitor_host and (monitor_server or targets):
+        collector_stats.count('datapoints', sum(len(multi_sender.getSender(zabbix_server)) for zabbix_server in updates))
+        addCollectorStats(multi_sender.getSender(monitor_server or targets[0]['zabbix_server']), now)
+
+    # Send data to all zabbix servers concurrently
+    started = time.time()
+    try:
+        send_results = multi_sender.sendData()
+    except Exception, error:
+        print >> sys.stderr, 'Collector ERROR: zabbix servers: %s' % error
+        send_results = {}
+    send_stats.addTiming('send', time.time() - started)
+    reachable = []
+    for zabbix_server, results in send_results.items():
+        send_stats.count('failed', multi_sender.getSender(zabbix_server).failedCount(results))
+        send_stats.count('send_errors', len([r for r in results if r[0] in (pyZabbixSender.RC_ERR_CONN, pyZabbixSender.RC_ERR_INV_RESP)]))
+        # Move watermarks forward only if the data reached the zabbix server or the spool
+        if spoolCloudWatchData(zabbix_server, multi_sender.getSender(zabbix_server), results):
+            delivered = True
+        else:
+            delivered = not sendFailed(results)
+            if delivered:
+                reachable.append(zabbix_server)
+        if watermarks is not None and zabbix_server in updates and delivered:
+            watermarks.update(updates[zabbix_server])
+    multi_sender.clearData()
+
+    # Send the spooled data of the zabbix servers reachable again
+    if spool is not None:
+        drainSpool(reachable)
+
+# Split a time range into chunks of at most the max number of datapoints returned by a get_metric_statistics call
+def splitTimeRange(f, t, p):
+    range_start = f
+    range_end = t
+    chunk = timedelta(seconds=int(p) * max_datapoints)
+
+    chunks = []
+    chunk_start = range_start
+    while chunk_start < range_end:
+        chunk_end = min(chunk_start + chunk, range_end)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+    return chunks
+
+# Backfill all cloudwatch data of the targets in a time range into zabbix
+# The range is split into chunks fetched concurrently, datapoints are streamed through a bounded queue
+# and sent to zabbix in fixed size batches, so memory doesn't grow with the length of the range.
+# Empty windows are not sent as zero, only datapoints found in cloudwatch are replayed
+def backfillCloudWatchData(t, f, e):
+    targets = t
+    range_start = f
+    range_end = e
+
+    # Chunks of every target to fetch
+    chunks = Queue.Queue()
+    for target in targets:
+        try:
+            queries = getResourceMetricQueries(target['account'], target['region'], target['service'], target['dimensions'], target.get('template'))
+        except Exception, error:
+            print >> sys.stderr, 'Backfill ERROR: %s %s on host %s: %s' % (target['service'], target['dimensions'], target['zabbix_host'], error)
+            continue
+        if queries is None:
+            print >> sys.stderr, 'No cloudwatch data collected for %s %s on host %s' % (target['service'], target['dimensions'], target['zabbix_host'])
+            continue
+        # Cloudwatch only lists metrics with data in the last two weeks, older ranges may have data of other metrics
+        for query in queries:
+            query.pop('absent', None)
+            query.pop('listed_at', None)
+        for chunk_start, chunk_end in splitTimeRange(range_start, range_end, target['period']):
+            chunks.put((target, queries, chunk_start, chunk_end))
+
+    # Datapoints of fetched chunks, a None marks a finished fetcher
+    datapoints = Queue.Queue(maxsize=backfill_queue_size)
+
+    def fetcher():
+        while True:
+            try:
+                target, queries, chunk_start, chunk_end = chunks.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                cw_data = fetchCloudWatchData(target['account'], target['region'], queries, (target['period'], chunk_start, chunk_end))
+                points = []
+                if cw_data is not None and fetchFailed(cw_data):
+                    print >> sys.stderr, 'Backfill ERROR: %s %s from %s to %s: some metrics could not be fetched' % (target['service'], target['dimensions'], chunk_start, chunk_end)
+                for cwdata in cw_data or []:
+                    statistics = cwdata['statistics']
+                    results = cwdata['cloud_watch_results'] or []
+                    for result, zabbix_key_timestamp in zip(results, utcToEpochs([result['Timestamp'] for result in results])):
+                        points.append((target['zabbix_host'], cwdata['zabbix_key'], result[statistics], zabbix_key_timestamp))
+                datapoints.put((target['zabbix_server'], points))
+            except Exception, error:
+                print >> sys.stderr, 'Backfill ERROR: %s %s from %s to %s: %s' % (target['service'], target['dimensions'], chunk_start, chunk_end, error)
+        datapoints.put(None)
+
+    fetchers = []
+    for i in range(max(1, fetch_concurrency)):
+        thread = threading.Thread(target=fetcher)
+        thread.daemon = True
+        thread.start()
+        fetchers.append(thread)
+
+    # Number of datapoints added to the zabbix sender of each zabbix server
+    counts = {}
+    stats = {'datapoints': 0, 'batches': 0, 'failed': 0}
+
+    def flush(zabbix_server):
+        zabbix_sender = getZabbixSender(zabbix_server)
+        send_results = zabbix_sender.sendData()
+        spoolCloudWatchData(zabbix_server, zabbix_sender, send_results)
+        for send_result in send_results:
+            stats['batches'] += 1
+            if send_result[0] != pyZabbixSender.RC_OK:
+                stats['failed'] += 1
+        zabbix_sender.clearData()
+        counts[zabbix_server] = 0
+
+    finished = 0
+    while finished < len(fetchers):
+        item = datapoints.get()
+        if item is None:
+            finished += 1
+            continue
+        zabbix_server, points = item
+        zabbix_sender = getZabbixSender(zabbix_server)
+        if zabbix_server not in counts:
+            zabbix_sender.clearData()
+            counts[zabbix_server] = 0
+        for zabbix_host, zabbix_key, zabbix_key_value, zabbix_key_timestamp in points:
+            zabbix_sender.addData(zabbix_host, zabbix_key, zabbix_key_value, zabbix_key_timestamp)
+            counts[zabbix_server] += 1
+            stats['datapoints'] += 1
+            if counts[zabbix_server] >= backfill_batch:
+                flush(zabbix_server)
+
+    # Send the rest of the datapoints
+    for zabbix_server in counts:
+        if counts[zabbix_server]:
+            flush(zabbix_server)
+
+    print 'Backfill: %d datapoints sent in %d batches, %d batches failed' % (stats['datapoints'], stats['batches'], stats['failed'])
+    return stats
+
+# Collect the inventory once, or keep collecting it every period in daemon mode
+def runCollector(t, p, daemon=False):
+    targets = t
+    collector_period = p
+
+    # Give up the shard when the daemon is stopped, so other collectors take it over at their next cycle
+    if daemon and shards is not None:
+        signal.signal(signal.SIGTERM, stopCollector)
+    owned_keys = None
+    try:
+        # The inventory is loaded once and reused in every cycle
+        while True:
+            shard_targets = targets
+            if shards is not None:
+                shards.renew()
+                shard_targets = [target for target in targets if shards.owns(targetShardKey(target))]
+                # Targets taken over from other collectors continue from the watermarks they wrote
+                keys = set(targetShardKey(target) for target in shard_targets)
+                if watermarks is not None and owned_keys is not None and keys - owned_keys:
+                    watermarks.reload()
+                owned_keys = keys
+            collectInventory(shard_targets, datetime.utcnow())
+            if not daemon:
+                break
+            # Sleep until the next period boundary, so cycles don't drift
+            time.sleep(collector_period - (time.time() % collector_period))
+    finally:
+        if daemon and shards is not None:
+            shards.release()
+
+# Stop the collector on SIGTERM
+def stopCollector(signum, frame):
+    sys.exit(0)
+
+# Get the shard key of a target, the same in all collector processes and nodes
+def targetShardKey(t):
+    target = t
+    return '|'.join([target['account'], target['region'], target['service'], json.dumps(target['dimensions'], sort_keys=True), target['zabbix_host']])
+
+# Run the collector in forked worker processes, each collects its own shard of the inventory
+# Workers are named <node>.<number> in the shard file, the parent forwards SIGTERM to them and waits for them
+def runWorkers(t, p, f, n, w, daemon=False):
+    global shards
+    targets = t
+    collector_period = p
+    shard_file = f
+    node = n
+    workers = w
+
+    members = ['%s.%d' % (node, i) for i in range(workers)]
+    lease_ttl = 3 * collector_period
+    # Register all workers before they start, so their first cycles already split the inventory
+    for member in members:
+        member_shards = cloudWatchShards(shard_file, member, lease_ttl)
+        member_shards.renew()
+        member_shards.close()
+    if watermarks is not None:
+        watermarks.close()
+
+    children = []
+    for member in members:
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                # Connections opened by the parent are not shared with workers
+                shards = cloudWatchShards(shard_file, member, lease_ttl)
+                if watermarks is not None:
+                    watermarks.reload()
+                runCollector(targets, collector_period, daemon)
+                closeConnections()
+            except (SystemExit, KeyboardInterrupt):
+                closeConnections()
+            except:
+                traceback.print_exc()
+                status = 1
+            os._exit(status)
+        children.append(pid)
+
+    # Forward SIGTERM to the workers still running
+    def stopWorkers(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+    signal.signal(signal.SIGTERM, stopWorkers)
+    status = 0
+    while children:
+        try:
+            pid, child_status = os.wait()
+        except OSError, e:
+            # Interrupted by SIGTERM
+            continue
+        children.remove(pid)
+        status = status or child_status >> 8
+    return status
+
+# Get targets of a service from command line dimensions and zabbix hosts,
+# a single zabbix host is used for all dimensions, and a single zabbix template if it is given
+def getCommandLineTargets(z, x, a, r, s, d, p, t=None):
+    zabbix_server = z
+    zabbix_hosts = x
+    aws_account = a
+    aws_region = r
+    aws_service = s
+    dimensions_list = d
+    period = p
+    template = t
+
+    if len(zabbix_hosts) == 1:
+        zabbix_hosts = zabbix_hosts * len(dimensions_list)
+    if len(zabbix_hosts) != len(dimensions_list):
+        raise ValueError('Number of zabbix hosts does not match number of dimensions')
+
+    targets = []
+    for zabbix_host, dimensions in zip(zabbix_hosts, dimensions_list):
+        targets.append({
+            'zabbix_server': zabbix_server,
+            'zabbix_host': zabbix_host,
+            'account': aws_account,
+            'region': aws_region,
+            'service': aws_service,
+            'dimensions': dimConvert(dimensions),
+            'period': int(period or default_period),
+            'lag': service_lag.get(aws_service, default_lag),
+        })
+        if template:
+            targets[-1]['template'] = template
+    return targets
 
 if __name__ == '__main__':
     parser = config_parser()
@@ -345,58 +1114,96 @@ if __name__ == '__main__':
     # Read options from parser
     (options, args) = parser.parse_args()
     zabbix_server = options.zabbixserver
-    zabbix_host =  options.zabbixhost
+    fetch_batch = options.batch
+    fetch_concurrency = int(options.concurrency)
+    if options.rate:
+        fetch_rate = float(options.rate)
+    if options.watermark:
+        watermarks = cloudWatchWatermark(options.watermark)
+    if options.maxbackfill:
+        max_backfill = int(options.maxbackfill)
+    if options.sendtimeout:
+        send_timeout = int(options.sendtimeout)
+    if options.isolaterejected:
+        isolate_rejected = True
+    if options.spool:
+        spool = cloudWatchSpool(options.spool)
+    if options.monitorhost:
+        monitor_host = options.monitorhost
+        monitor_server = zabbix_server
+    if options.listttl:
+        metric_index = cloudWatchMetricIndex(int(options.listttl))
+    if options.allmetrics:
+        aws_services_config = awsServicesConfig(aws_services_conf)
+    elif options.template and options.template not in template_index.getTemplates():
+        parser.error('no zabbix template named %s in %s' % (options.template, zabbix_templates_dir))
+    if options.emrttl:
+        emr_clusters = awsEMRClusterIndex(ttl=int(options.emrttl))
+    if options.cachedir or options.cachettl:
+        response_cache = cloudWatchCache(ttl=int(options.cachettl or cloudWatchCache.TTL), cache_dir=options.cachedir)
+
+    # Collect many resources in a single process, from an inventory file or from repeated dimensions and hosts
+    # Incremental fetch windows are handled by the collector too
+    if options.inventory or options.daemon or options.watermark or options.backfill or options.shardfile or len(options.dimensions or []) > 1:
+        if options.inventory or options.daemon:
+            targets = loadInventory(options.inventory or aws_inventory_conf, zabbix_server)
+        else:
+            targets = getCommandLineTargets(zabbix_server, options.zabbixhost, options.accountname, options.region, options.service, options.dimensions, options.period, options.template)
+        # Use a fixed time window for all targets if start time and end time are specified
+        if options.starttime and options.endtime:
+            start_time = datetime.strptime(options.starttime, "%Y-%m-%d %H:%M:%S")
+            end_time = datetime.strptime(options.endtime, "%Y-%m-%d %H:%M:%S")
+            for target in targets:
+                target['start_time'] = start_time
+                target['end_time'] = end_time
+        elif options.backfill:
+            parser.error('backfill needs start time and end time')
+        collector_period = int(options.period or default_period)
+        workers = int(options.workers or 1)
+        node = options.node or socket.gethostname()
+        if workers > 1 and not options.shardfile:
+            parser.error('workers need a shard file')
+        # Targets move between nodes, they must continue from the watermarks written by the node collecting them before
+        if options.shardfile and options.watermark and os.path.realpath(options.watermark) != os.path.realpath(options.shardfile):
+            parser.error('watermarks of sharded collectors are kept in the shard file, use the shard file as watermark file')
+        if options.backfill:
+            backfillCloudWatchData(targets, start_time, end_time)
+        elif workers > 1:
+            status = runWorkers(targets, collector_period, options.shardfile, node, workers, options.daemon)
+            closeConnections()
+            exit(status)
+        else:
+            if options.shardfile:
+                shards = cloudWatchShards(options.shardfile, node, 3 * collector_period)
+            runCollector(targets, collector_period, options.daemon)
+        closeConnections()
+        exit(0)
+
+    zabbix_host =  options.zabbixhost[0]
     aws_account = options.accountname
     aws_region = options.region
     aws_service = options.service
-    dimensions = dimConvert(options.dimensions)
+    dimensions = dimConvert(options.dimensions[0])
     period = options.period
 
     # Set global start time and end time in cloudwatch
     start_time = datetime.strptime(options.starttime, "%Y-%m-%d %H:%M:%S")
     end_time = datetime.strptime(options.endtime, "%Y-%m-%d %H:%M:%S")
 
-    if aws_service == 'DynamoDB':
-        table_name = dimensions['TableName']
-        # Get cloudwatch data of a DynamoDB table
-        cw_data = getCloudWatchDynamodbData(aws_account, aws_region, aws_service, table_name)
-        # Only use log buffer with "sendAllCloudWatchData" function
-        # log buffer is used to check the cloudwatch history data,
-        # set the number as low as possible to get the best performance,
-        # but should be more than the total number of monitoring items of the aws service in the host
-        ##log_buffer = 1000
-    elif aws_service == 'ElasticMapReduce':
-        # Identify EMR JobFlowId by Name
-        aws = awsAccount(aws_account)
-        aws_access_key_id = aws._aws_access_key_id
-        aws_secret_access_key = aws._aws_secret_access_key
-
-        conn = awsConnection()
-        conn.emrConnect(aws_region, aws_access_key_id, aws_secret_access_key)
-        cw = conn._aws_connection
+    # Get cloudwatch data of an AWS service
+    cw_data = getResourceCloudWatchData(aws_account, aws_region, aws_service, dimensions, options.template)
 
-        clusters = cw.list_clusters(cluster_states=['RUNNING', 'WAITING'])
+    if aws_service == 'ElasticMapReduce' and cw_data is None:
+        print "EMR not found."
+        exit(1)
+    if cw_data is None:
+        print >> sys.stderr, 'No cloudwatch data collected for %s %s' % (aws_service, dimensions)
+        exit(1)
 
-        job_flow_id = None
-        for cluster in clusters.clusters:
-            if cluster.name == dimensions['JobFlowId']:
-                job_flow_id = cluster.id
-
-        if job_flow_id is None:
-            print "EMR not found."
-            exit(1)
-
-        dimensions['JobFlowId'] = job_flow_id
-        # Get cloudwatch data of an AWS service
-        cw_data = getCloudWatchData(aws_account, aws_region, aws_service, dimensions)
-    else:
-        # Get cloudwatch data of an AWS service
-        cw_data = getCloudWatchData(aws_account, aws_region, aws_service, dimensions)
-        # Only use log buffer with "sendAllCloudWatchData" function
-        # log buffer is used to check the cloudwatch history data,
-        # set the number as low as possible to get the best performance,
-        # but should be more than the total number of monitoring items of the aws service in the host
-        ##log_buffer = 500
+    # Only use log retention with "sendAllCloudWatchData" function
+    # log retention is the max age in seconds of sent datapoints kept in the cloudwatch log,
+    # it should be longer than the time window used for getting cloudwatch data
+    ##log_retention = 86400
 
     # Send latest cloudwatch data with zabbix sender
     sendLatestCloudWatchData(zabbix_server, zabbix_host, cw_data)
@@ -404,4 +1211,6 @@ if __name__ == '__main__':
     # Send all cloudwatch data in a specified time window with zabbix sender
     #cw_log = initCloudWatchLog(aws_service, zabbix_host, aws_region)
     #sendAllCloudWatchData(zabbix_server, zabbix_host, cw_data, cw_log)
-    #purgeOldCloudWatchLog(cw_log, log_buffer)
+    #purgeOldCloudWatchLog(cw_log, log_retention)
+
+    closeConnections()
@@ -0,0 +1,265 @@
+# Description: A class to send data to many zabbix servers and proxies concurrently
+# Data points are tagged with their zabbix server, and one connection per server is kept open between sends,
+# it is only reused if the server keeps it open too: a zabbix server closes it after each response, so each send reconnects.
+# Packets are sent to all servers at the same time with non-blocking sockets, and each server has its own timeout,
+# so a slow or unreachable server doesn't delay the data of the other servers.
+# Server names are resolved in threads, a slow DNS lookup only delays the data of its own server
+
+import os
+import sys
+import time
+import errno
+import socket
+import select
+import struct
+import threading
+from pyZabbixSender import pyZabbixSender
+
+class zabbixMultiSender:
+    # Size of the zabbix protocol header: "ZBXD", protocol version and data length
+    HEADER_SIZE = 13
+
+    _port = 10051
+    _timeout = 30
+    # Max seconds between checks of the name lookups still running
+    RESOLVE_INTERVAL = 0.05
+
+    _senders = None
+    _connections = None
+    _timeouts = None
+
+    def __init__(self, port=10051, timeout=30):
+        self._port = port
+        # Max time in seconds to send all data of one zabbix server, unless the server has its own
+        self._timeout = timeout
+        # Senders storing the data of each zabbix server
+        self._senders = {}
+        # Open connections by zabbix server
+        self._connections = {}
+        # Timeouts of the zabbix servers which have their own
+        self._timeouts = {}
+
+    # Get the sender storing the data of a zabbix server
+    def getSender(self, server):
+        if server not in self._senders:
+            self._senders[server] = pyZabbixSender(server=server, port=self._port)
+        return self._senders[server]
+
+    # Set the max time in seconds to send all data of a zabbix server
+    def setTimeout(self, server, timeout):
+        self._timeouts[server] = timeout
+
+    # Get the max time in seconds to send all data of a zabbix server
+    def getTimeout(self, server):
+        return self._timeouts.get(server, self._timeout)
+
+    # Add a data point to send to a zabbix server
+    def addData(self, server, host, key, value, clock=None):
+        self.getSender(server).addData(host, key, value, clock)
+
+    # Remove data of all zabbix servers
+    def clearData(self):
+        for sender in self._senders.values():
+            sender.clearData()
+
+    # Close all open connections
+    def close(self):
+        for sock in self._connections.values():
+            sock.close()
+        self._connections = {}
+
+    # Check if a kept connection is still open, a connection closed by the server is readable and returns no data
+    def _isAlive(self, sock):
+        try:
+            readable, writable, failed = select.select([sock], [], [sock], 0)
+            if failed:
+                return False
+            if readable:
+                return sock.recv(1, socket.MSG_PEEK) != ''
+            return True
+        except (socket.error, select.error):
+            return False
+
+    # Look up the address of a zabbix server in a thread, the name lookup blocks
+    def _resolve(self, state):
+        def resolve():
+            try:
+                state['address'] = socket.getaddrinfo(state['server'], self._port, socket.AF_INET, socket.SOCK_STREAM)[0][4]
+            except socket.error, err:
+                state['resolve_error'] = err
+            state['resolved'].set()
+        state['resolved'] = threading.Event()
+        thread = threading.Thread(target=resolve)
+        thread.daemon = True
+        thread.start()
+
+    # Start a non-blocking connection to a zabbix server
+    # The connection is started later by sendData if the address of the server is not resolved yet
+    def _connect(self, state):
+        state['sock'] = None
+        state['connecting'] = False
+        if not state['resolved'].is_set():
+            return
+        if state['address'] is None:
+            raise socket.error('Cannot resolve %s: %s' % (state['server'], state['resolve_error']))
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(0)
+        err = sock.connect_ex(state['address'])
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            raise socket.error(err, os.strerror(err))
+        state['sock'] = sock
+        state['reused'] = False
+        state['connecting'] = err != 0
+
+    # Close the connection of a zabbix server
+    def _disconnect(self, state):
+        if state['sock'] is not None:
+            state['sock'].close()
+            state['sock'] = None
+        self._connections.pop(state['server'], None)
+
+    # Move to the next packet of a zabbix server, returns False when all packets are sent
+    def _nextPacket(self, state):
+        # Drop the reference to the sent packet, so its buffer can be reused
+        state['packet'] = None
+        state['packet'] = next(state['packets'], None)
+        if state['packet'] is None:
+            if state['sock'] is not None:
+                self._connections[state['server']] = state['sock']
+            return False
+        state['sent'] = 0
+        state['response'] = ''
+        # Keep sending on the connection of the last packet while the server keeps it open
+        if state['sock'] is not None:
+            if self._isAlive(state['sock']):
+                state['reused'] = True
+            else:
+                self._disconnect(state)
+        if state['sock'] is None:
+            try:
+                self._connect(state)
+            except socket.error, err:
+                return self._failPacket(state, err)
+        return True
+
+    # Record a failed packet of a zabbix server and move to the next packet on a new connection
+    def _failPacket(self, state, err):
+        self._disconnect(state)
+        err_message = u'Error talking to server %s: %s\n' % (state['server'], str(err))
+        sys.stderr.write(err_message)
+        state['results'].append((pyZabbixSender.RC_ERR_CONN, err_message))
+        return self._nextPacket(state)
+
+    # Send or read data of a zabbix server whose connection is ready, returns False when all packets are sent
+    def _step(self, state):
+        sock = state['sock']
+        try:
+            if state['connecting']:
+                err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err:
+                    raise socket.error(err, os.strerror(err))
+                state['connecting'] = False
+            elif state['sent'] < len(state['packet']):
+                state['sent'] += sock.send(state['packet'][state['sent']:])
+            else:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    raise socket.error('Connection closed by server')
+                state['response'] += chunk
+                response = state['response']
+                if len(response) >= 5 and response[:5] != 'ZBXD\1':
+                    self._disconnect(state)
+                    err_message = u'Invalid response from server %s. Malformed data?\n' % state['server']
+                    sys.stderr.write(err_message)
+                    state['results'].append((pyZabbixSender.RC_ERR_INV_RESP, err_message))
+                    return self._nextPacket(state)
+                if len(response) >= self.HEADER_SIZE:
+                    response_len = struct.unpack('<i', response[5:9])[0]
+                    if len(response) >= self.HEADER_SIZE + response_len:
+                        sender = self._senders[state['server']]
+                        state['results'].append(sender.parseResponse(response[self.HEADER_SIZE:self.HEADER_SIZE + response_len], state['packet']))
+                        return self._nextPacket(state)
+        except socket.error, err:
+            if state['reused'] and state['response'] == '':
+                # The kept connection was closed by the server, send the packet again on a new connection
+                self._disconnect(state)
+                state['sent'] = 0
+                try:
+                    self._connect(state)
+                except socket.error, err:
+                    return self._failPacket(state, err)
+                return True
+            return self._failPacket(state, err)
+        return True
+
+    # Record the remaining packets of a zabbix server as failed after its timeout
+    def _expire(self, state):
+        self._disconnect(state)
+        err_message = u'Timeout talking to server %s after %s seconds\n' % (state['server'], self.getTimeout(state['server']))
+        sys.stderr.write(err_message)
+        state['results'].append((pyZabbixSender.RC_ERR_CONN, err_message))
+        state['packet'] = None
+        for packet in state['packets']:
+            state['results'].append((pyZabbixSender.RC_ERR_CONN, err_message))
+
+    # Send data of all zabbix servers concurrently, each server has its own timeout
+    # Returns the list of (return_code, msg_from_server) of each packet by zabbix server, like pyZabbixSender.sendData
+    def sendData(self, packet_clock=None, max_data_per_conn=None):
+        results = {}
+        active = []
+        started = time.time()
+        for server, sender in self._senders.items():
+            results[server] = []
+            if not len(sender):
+                continue
+            state = {
+                'server': server,
+                'packets': sender.getPackets(packet_clock, max_data_per_conn),
+                'packet': None,
+                'sock': None,
+                'reused': False,
+                'connecting': False,
+                'results': results[server],
+                'deadline': started + self.getTimeout(server),
+                'address': None,
+                'resolve_error': None,
+            }
+            self._resolve(state)
+            # Reuse the connection kept open by the last send
+            state['sock'] = self._connections.get(server)
+            if self._nextPacket(state):
+                active.append(state)
+
+        while active:
+            now = time.time()
+            for state in [s for s in active if s['deadline'] <= now]:
+                self._expire(state)
+                active.remove(state)
+            # Connect to the servers whose address was resolved since the last check
+            for state in [s for s in active if s['sock'] is None and s['resolved'].is_set()]:
+                try:
+                    self._connect(state)
+                except socket.error, err:
+                    if not self._failPacket(state, err):
+                        active.remove(state)
+            if not active:
+                break
+            # Wait for connections ready to write a packet or to read a response
+            connected = [s for s in active if s['sock'] is not None]
+            writing = [s['sock'] for s in connected if s['connecting'] or s['sent'] < len(s['packet'])]
+            reading = [s['sock'] for s in connected if not s['connecting'] and s['sent'] >= len(s['packet'])]
+            wait = min(s['deadline'] for s in active) - now
+            if len(connected) < len(active):
+                wait = min(wait, self.RESOLVE_INTERVAL)
+            try:
+                readable, writable, failed = select.select(reading, writing, [], wait)
+            except select.error, err:
+                if err.args[0] == errno.EINTR:
+                    continue
+                raise
+            ready = set(readable) | set(writable)
+            for state in [s for s in connected if s['sock'] in ready]:
+                if not self._step(state):
+                    active.remove(state)
+        return results
@@ -0,0 +1,83 @@
+# Description: A class to index the zabbix trapper item keys defined in the zabbix templates, by template and by aws service
+# Keys are indexed without their parameters, e.g. SQS.NumberOfMessagesSent.Sum, the aws service is the first part of the key
+# The templates are parsed once, and parsed again only when a template is added, removed or modified
+
+import os
+import glob
+import time
+import threading
+import xml.etree.ElementTree as ElementTree
+
+class zabbixTemplateIndex:
+    # Zabbix item type of trapper items
+    TRAPPER_TYPE = '2'
+    # Min seconds between checks of the template files for changes
+    CHECK_INTERVAL = 60
+    # Keys of the timings and counters the collector sends about itself, they are not cloudwatch metrics
+    COLLECTOR_KEYS = 'zabbixCloudWatch.'
+
+    _templates_dir = None
+    _checked = 0
+    _mtimes = None
+    _templates = None
+    _services = None
+    # Incremented every time the templates are parsed
+    version = 0
+
+    def __init__(self, templates_dir):
+        self._templates_dir = templates_dir
+        self._lock = threading.Lock()
+
+    # Get the key of a zabbix item without its parameters
+    def keyName(self, key):
+        return key.split('[', 1)[0]
+
+    # Parse a template file, returns a dict of the trapper keys by template name
+    def _parse(self, template_file):
+        templates = {}
+        root = ElementTree.parse(template_file).getroot()
+        for template in root.findall('templates/template'):
+            name = template.findtext('name') or template.findtext('template')
+            keys = templates.setdefault(name, set())
+            # Items of the template and item prototypes of its discovery rules
+            for item in template.iter():
+                if item.tag in ('item', 'item_prototype') and item.findtext('type') == self.TRAPPER_TYPE:
+                    if item.findtext('key').startswith(self.COLLECTOR_KEYS):
+                        continue
+                    keys.add(self.keyName(item.findtext('key')))
+        return templates
+
+    # Parse the templates again if a template file was added, removed or modified since they were parsed
+    def _reload(self):
+        if time.time() - self._checked < self.CHECK_INTERVAL:
+            return
+        with self._lock:
+            template_files = glob.glob(os.path.join(self._templates_dir, '*.xml'))
+            mtimes = dict((template_file, os.path.getmtime(template_file)) for template_file in template_files)
+            if mtimes != self._mtimes:
+                templates = {}
+                for template_file in sorted(template_files):
+                    templates.update(self._parse(template_file))
+                services = {}
+                for keys in templates.values():
+                    for key in keys:
+                        services.setdefault(key.split('.', 1)[0], set()).add(key)
+                self._templates = templates
+                self._services = services
+                self._mtimes = mtimes
+                self.version += 1
+            self._checked = time.time()
+
+    # Get the trapper keys of each template, a dict of sets of keys by template name
+    def getTemplates(self):
+        self._reload()
+        return self._templates
+
+    # Get the trapper keys of an aws service in all templates, or in one template if it is given,
+    # None if no template has keys of the service
+    def getKeys(self, aws_service, template=None):
+        self._reload()
+        if template is None:
+            return self._services.get(aws_service)
+        keys = set(key for key in self._templates.get(template, ()) if key.split('.', 1)[0] == aws_service)
+        return keys or None
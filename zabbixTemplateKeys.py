@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# Description: A script to cross-index the trapper item keys of the zabbix templates against the aws services metrics configuration
+# Lists the configured metrics without a trapper item, which zabbixCloudWatch.py doesn't fetch,
+# and the trapper items without a configured metric, which never get data
+# Example Usage: zabbixTemplateKeys.py
+# Service Usage: zabbixTemplateKeys.py -s ElastiCache -v
+
+import os
+import sys
+from optparse import OptionParser
+from awsServicesConfig import awsServicesConfig
+from zabbixTemplateIndex import zabbixTemplateIndex
+
+base_path = os.path.dirname(os.path.realpath(__file__))
+
+def config_parser():
+    parser = OptionParser(usage="usage: %prog [options]", version="%prog 1.0")
+    parser.add_option("-c", "--config", dest="config", default=base_path + '/conf/aws_services_metrics.conf', help="aws services metrics configuration file", metavar="CONFIG")
+    parser.add_option("-t", "--templates", dest="templates", default=base_path + '/templates', help="directory of the zabbix templates", metavar="TEMPLATES")
+    parser.add_option("-s", "--service", dest="service", action="append", help="aws service, repeat to check many services, default all", metavar="SERVICE")
+    parser.add_option("-v", "--verbose", dest="verbose", action="store_true", default=False, help="List the keys of each template and service")
+    return parser
+
+# Print the keys of a list, indented under a heading
+def printKeys(h, k):
+    heading = h
+    keys = k
+    if keys:
+        print '    %s:' % heading
+        for key in sorted(keys):
+            print '        ' + key
+
+if __name__ == '__main__':
+    parser = config_parser()
+    (options, args) = parser.parse_args()
+
+    template_index = zabbixTemplateIndex(options.templates)
+    services_config = awsServicesConfig(options.config)
+    templates = template_index.getTemplates()
+    services = options.service or sorted(set(services_config.getServices()) | set(key.split('.', 1)[0] for keys in templates.values() for key in keys))
+
+    # Keys of the metric plan of each service, as sent by zabbixCloudWatch.py
+    print '%-20s %10s %10s %10s %14s' % ('service', 'configured', 'templates', 'fetched', 'not_configured')
+    mismatches = 0
+    for aws_service in services:
+        if aws_service in services_config.getServices():
+            configured = set(template_index.keyName(entry['key_template']) for entry in services_config.getPlan(aws_service))
+        else:
+            configured = set()
+        template_keys = template_index.getKeys(aws_service)
+        if template_keys is None:
+            # Services without templates keep all configured metrics
+            fetched = configured
+            template_keys = set()
+        else:
+            fetched = configured & template_keys
+        print '%-20s %10d %10d %10d %14d' % (aws_service, len(configured), len(template_keys), len(fetched), len(template_keys - configured))
+        mismatches += len(configured - fetched) + len(template_keys - configured)
+        printKeys('configured without trapper item', configured - fetched)
+        printKeys('trapper item without configured metric', template_keys - configured)
+
+    # Trapper keys of each template, and the configured metrics of its services it has no item for
+    # e.g. memcached metrics are not in the redis template of ElastiCache
+    if options.verbose:
+        for name in sorted(templates):
+            keys = templates[name]
+            aws_services = sorted(set(key.split('.', 1)[0] for key in keys))
+            if options.service and not set(aws_services) & set(options.service):
+                continue
+            configured = set()
+            for aws_service in set(aws_services) & set(services_config.getServices()):
+                configured |= set(template_index.keyName(entry['key_template']) for entry in services_config.getPlan(aws_service))
+            print
+            print '%s: %d trapper keys of %s, %d configured metrics without item' % (name, len(keys), ', '.join(aws_services), len(configured - keys))
+            printKeys('trapper keys', keys)
+            printKeys('configured without trapper item', configured - keys)
+
+    sys.exit(1 if mismatches else 0)